@@ -1,32 +1,50 @@
 """
 Package: app
 Package for the application models and services.
-This module also sets up the logging to be used with gunicorn
+
+create_app() builds the Flask application. It opens no database
+connection, so gunicorn can build the app once in the master with
+--preload and every worker starts its own pool after the fork (see
+gunicorn.conf.py). The logging is set up by app/logs.py
 """
 
-import logging
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-import ibm_db_sa
-
-# Create Flask application
-app = Flask(__name__)
+from .pool import PooledSQLAlchemy
+from .logs import initialize_logging
 
-# Load the confguration
-app.config.from_object('config')
-app.config['LOGGING_LEVEL'] = logging.INFO
-#print('Database URI {}'.format(app.config['SQLALCHEMY_DATABASE_URI']))
+# SQLAlchemy with the pool options of the configuration, bound to an app
+# by create_app(). The database driver is imported when the engine is
+# first used
+db = PooledSQLAlchemy()
 
+def create_app(config=None):
+    """
+    Creates the Flask application of the service
 
-# Initialize SQLAlchemy
-db = SQLAlchemy(app)
+    config - a dictionary of settings that override the ones in config.py
+    """
+    from .models import Promotion
+    from .health import ReadinessCheck
+    from .compression import CompressionMiddleware
+    from . import metrics, service
 
-# Set up the logging for production
-print 'Setting up logging for {}...'.format(__name__)
-if __name__ != '__main__':
-    gunicorn_logger = logging.getLogger('gunicorn.error')
-    if gunicorn_logger:
-        app.logger.handlers = gunicorn_logger.handlers
-        app.logger.setLevel(gunicorn_logger.level)
+    app = Flask(__name__)
+    app.config.from_object('config')
+    if config:
+        app.config.update(config)
 
-app.logger.info('Logging established')
+    initialize_logging(app)
+    db.init_app(app)
+    Promotion.init_cache(app.config)
+    metrics.init_app(app)
+    app.extensions['readiness'] = ReadinessCheck(app.config['READY_CHECK_INTERVAL'],
+                                                 app.config['READY_MAX_RTT_MS'],
+                                                 app.config['READY_MAX_POOL_SATURATION'])
+    app.register_blueprint(service.blueprint)
+    if app.config['COMPRESSION_ENABLED']:
+        app.wsgi_app = CompressionMiddleware(app.wsgi_app,
+                                             app.config['COMPRESSION_MIN_SIZE'],
+                                             app.config['COMPRESSION_LEVEL'],
+                                             app.config['COMPRESSION_BROTLI_QUALITY'],
+                                             app.config['COMPRESSION_FLUSH_SIZE'])
+    return app
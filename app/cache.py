@@ -0,0 +1,325 @@
+"""
+Caching for the Promotion Demo Service
+
+Cache - the interface of the cache backends
+LRUCache - a bounded least recently used cache whose entries expire
+           after a time to live, private to each worker process
+SharedCache - a cache stored in a SQLite file that all of the gunicorn
+              workers on a host read and invalidate together
+
+Every backend keeps version counters for its keys. A reader takes the
+version of a key before it loads the value from the database and hands it
+back to set(). Any invalidation in between, in this worker or another one,
+changes the version and the stale value is not stored
+"""
+import os
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+# number of version counters, keys are hashed onto them
+VERSION_SLOTS = 4096
+
+def version_slot(key):
+    """ Returns the version counter of key, the same in every process """
+    return zlib.crc32(str(key).encode('utf-8')) % VERSION_SLOTS
+
+class Cache(object):
+    """ The interface of the cache backends """
+
+    backend = None
+
+    def version(self, key):
+        """ Returns the current version of key, to be passed to set() """
+        raise NotImplementedError
+
+    def get(self, key):
+        """ Returns the value cached for key or None """
+        raise NotImplementedError
+
+    def set(self, key, value, version=None):
+        """ Caches value under key unless key changed since version """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """ Invalidates key """
+        raise NotImplementedError
+
+    def clear(self):
+        """ Invalidates all of the keys """
+        raise NotImplementedError
+
+    def stats(self):
+        """ Returns the counters of the cache as a dictionary """
+        raise NotImplementedError
+
+
+class LRUCache(Cache):
+    """
+    A thread safe least recently used cache with a time to live
+
+    When more than maxsize entries are stored the least recently used one
+    is evicted. Entries older than ttl seconds are treated as misses
+    """
+
+    backend = 'memory'
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._versions = [0] * VERSION_SLOTS
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def version(self, key):
+        """ Returns the current version of key, to be passed to set() """
+        with self._lock:
+            return self._generation, self._versions[version_slot(key)]
+
+    def get(self, key):
+        """ Returns the value cached for key or None """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] < time.time():
+                self.misses += 1
+                return None
+            # re-insert the entry to mark it as the most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, version=None):
+        """ Caches value under key, evicting the least recently used entries """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if version is not None and \
+               version != (self._generation, self._versions[version_slot(key)]):
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + self.ttl)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """ Removes the entry for key if there is one """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._versions[version_slot(key)] += 1
+
+    def clear(self):
+        """ Removes all of the entries """
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        """ Returns the counters of the cache as a dictionary """
+        with self._lock:
+            return {'backend': self.backend,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self._entries),
+                    'maxsize': self.maxsize,
+                    'ttl': self.ttl}
+
+
+class SharedCache(Cache):
+    """
+    A cache shared by all of the processes that open the same SQLite file
+
+    It stands in for a Redis style store: values are JSON documents and
+    the version counters live in the file, so an invalidation done by one
+    gunicorn worker is seen by all the others. Each process and thread
+    opens its own connection. Read errors are treated as misses. A failed
+    invalidation is logged and counted, the entry then lives until its ttl
+    but the write to the database that caused it still succeeds
+    """
+
+    backend = 'shared'
+    # how many set() calls between two checks of maxsize
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, path, maxsize=10000, ttl=60):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.failed_invalidations = 0
+        self._sets = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        with self._transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                         'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS versions ('
+                         'slot INTEGER PRIMARY KEY, version INTEGER NOT NULL)')
+
+    def _connection(self):
+        """ Returns the connection of this thread, reopened after a fork """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self):
+        """ Returns the connection inside a write transaction """
+        return _Transaction(self._connection())
+
+    def _read_version(self, conn, key):
+        """ Reads the (generation, slot version) of key """
+        rows = conn.execute('SELECT slot, version FROM versions WHERE slot IN (?, ?)',
+                            (-1, version_slot(key))).fetchall()
+        versions = dict(rows)
+        return versions.get(-1, 0), versions.get(version_slot(key), 0)
+
+    def _bump(self, conn, slot):
+        """ Increments the version counter in slot """
+        conn.execute('INSERT OR IGNORE INTO versions (slot, version) VALUES (?, 0)', (slot,))
+        conn.execute('UPDATE versions SET version = version + 1 WHERE slot = ?', (slot,))
+
+    def version(self, key):
+        """ Returns the current version of key, to be passed to set() """
+        try:
+            return self._read_version(self._connection(), key)
+        except sqlite3.Error as error:
+            self.logger.warning('Cache version read failed: %s', error)
+            # a version that never matches, so nothing gets cached
+            return (None, None)
+
+    def get(self, key):
+        """ Returns the value cached for key or None """
+        try:
+            row = self._connection().execute(
+                'SELECT value FROM entries WHERE key = ? AND expires > ?',
+                (str(key), time.time())).fetchone()
+        except sqlite3.Error as error:
+            self.logger.warning('Cache read failed: %s', error)
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, version=None):
+        """ Caches value under key unless key changed since version """
+        if self.maxsize <= 0:
+            return
+        try:
+            with self._transaction() as conn:
+                if version is not None and version != self._read_version(conn, key):
+                    return
+                conn.execute('INSERT OR REPLACE INTO entries (key, value, expires) VALUES (?, ?, ?)',
+                             (str(key), json.dumps(value), time.time() + self.ttl))
+                with self._lock:
+                    self._sets += 1
+                    prune = self._sets % self.PRUNE_INTERVAL == 0
+                if prune:
+                    self._prune(conn)
+        except sqlite3.Error as error:
+            self.logger.warning('Cache write failed: %s', error)
+
+    def _prune(self, conn):
+        """ Removes the expired entries and the oldest ones above maxsize """
+        conn.execute('DELETE FROM entries WHERE expires <= ?', (time.time(),))
+        extra = conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0] - self.maxsize
+        if extra > 0:
+            conn.execute('DELETE FROM entries WHERE key IN '
+                         '(SELECT key FROM entries ORDER BY expires LIMIT ?)', (extra,))
+            with self._lock:
+                self.evictions += extra
+
+    def delete(self, key):
+        """ Removes the entry for key in every process """
+        try:
+            with self._transaction() as conn:
+                conn.execute('DELETE FROM entries WHERE key = ?', (str(key),))
+                self._bump(conn, version_slot(key))
+        except sqlite3.Error as error:
+            self._invalidation_failed(error)
+
+    def clear(self):
+        """ Removes all of the entries in every process """
+        try:
+            with self._transaction() as conn:
+                conn.execute('DELETE FROM entries')
+                self._bump(conn, -1)
+        except sqlite3.Error as error:
+            self._invalidation_failed(error)
+
+    def _invalidation_failed(self, error):
+        """ Logs and counts a delete() or clear() that could not be written """
+        self.logger.error('Cache invalidation failed, entries may be stale for %s s: %s',
+                          self.ttl, error)
+        with self._lock:
+            self.failed_invalidations += 1
+
+    def stats(self):
+        """ Returns the counters of the cache as a dictionary """
+        size = self._connection().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        with self._lock:
+            return {'backend': self.backend,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'failed_invalidations': self.failed_invalidations,
+                    'size': size,
+                    'maxsize': self.maxsize,
+                    'ttl': self.ttl,
+                    'path': self.path}
+
+
+class _Transaction(object):
+    """ Runs a block of statements in an immediate SQLite transaction """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.conn.execute('COMMIT')
+        else:
+            self.conn.execute('ROLLBACK')
+        return False
+
+
+def create_cache(config):
+    """
+    Creates the cache backend selected by CACHE_BACKEND in config
+
+    memory - an LRUCache in each worker process
+    shared - a SharedCache in the file CACHE_PATH
+    """
+    backend = config.get('CACHE_BACKEND', 'memory')
+    maxsize = config['PROMOTION_CACHE_SIZE']
+    ttl = config['PROMOTION_CACHE_TTL']
+    if backend == 'memory':
+        return LRUCache(maxsize, ttl)
+    if backend == 'shared':
+        path = config.get('CACHE_PATH') or os.path.join(tempfile.gettempdir(), 'promotions-cache.db')
+        return SharedCache(path, maxsize, ttl)
+    raise ValueError('Unknown CACHE_BACKEND: {}'.format(backend))
@@ -0,0 +1,190 @@
+"""
+Response compression for the Promotion Demo Service
+
+CompressionMiddleware wraps the WSGI app and compresses the JSON and text
+responses with brotli (when the brotli package is installed), gzip or
+deflate, whichever the Accept-Encoding header of the client prefers.
+
+Responses with a Content-Length below min_size are sent as they are.
+Streamed responses, which have no Content-Length, are compressed chunk by
+chunk as the app yields them and flushed every flush_size bytes, so they
+stay streamed instead of waiting in the buffers of the compressor. Responses that are
+already encoded and 204 / 304 responses are left alone
+"""
+import zlib
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# the encodings in the order the service prefers them
+ENCODINGS = (('br', 'gzip', 'deflate') if brotli is not None and hasattr(brotli, 'Compressor')
+             else ('gzip', 'deflate'))
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson',
+                      'application/javascript', 'application/xml')
+
+def parse_accept_encoding(value):
+    """ Returns the encodings of an Accept-Encoding header with their q values """
+    accepted = {}
+    for item in value.split(','):
+        parts = item.strip().split(';')
+        if not parts[0]:
+            continue
+        quality = 1.0
+        for parameter in parts[1:]:
+            name, _, number = parameter.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        accepted[parts[0].strip().lower()] = quality
+    return accepted
+
+def negotiate(header, encodings=ENCODINGS):
+    """ Returns the preferred encoding of encodings that header accepts or None """
+    accepted = parse_accept_encoding(header or '')
+    best = None
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best else None
+
+
+class Compressor(object):
+    """ Compresses a stream of chunks with one encoding """
+
+    def __init__(self, encoding, level=6, brotli_quality=4):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+            self.compress = self._compressor.process
+            self._flush = self._compressor.flush
+            self._finish = self._compressor.finish
+        else:
+            wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+            self.compress = self._compressor.compress
+            self._flush = lambda: self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = self._compressor.flush
+
+    def flush(self):
+        """ Returns the compressed data of everything so far, the stream goes on """
+        return self._flush()
+
+    def finish(self):
+        """ Returns the end of the compressed stream """
+        return self._finish()
+
+
+class CompressionMiddleware(object):
+    """ WSGI middleware that compresses the responses of app """
+
+    def __init__(self, app, min_size=1024, level=6, brotli_quality=4, flush_size=16384):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.flush_size = flush_size
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate(environ.get('HTTP_ACCEPT_ENCODING'))
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            encoding = None
+        response = {}
+
+        def capture(status, headers, exc_info=None):
+            """ Holds the start of the response until the body is seen """
+            if exc_info is not None:
+                response.clear()
+                return start_response(status, headers, exc_info)
+            response['status'] = status
+            response['headers'] = headers
+            return write
+
+        def write(data):
+            """ The write() callable of WSGI, which Flask never uses """
+            raise RuntimeError('CompressionMiddleware does not support write()')
+
+        app_iter = self.app(environ, capture)
+        if not response:
+            return app_iter
+        status, headers = response['status'], response['headers']
+        if not self.compressible(status, headers):
+            start_response(status, headers)
+            return app_iter
+        headers = add_vary(headers)
+        length = header_value(headers, 'Content-Length')
+        if encoding is None or (length is not None and int(length) < self.min_size):
+            start_response(status, headers)
+            return app_iter
+
+        compressor = Compressor(encoding, self.level, self.brotli_quality)
+        headers = [(name, value) for name, value in headers
+                   if name.lower() not in ('content-length', 'content-encoding')]
+        headers.append(('Content-Encoding', encoding))
+        headers = weaken_etag(headers)
+        if length is None:
+            start_response(status, headers)
+            return stream(app_iter, compressor, self.flush_size)
+        try:
+            body = ''.join(compressor.compress(chunk) for chunk in app_iter) + compressor.finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        headers.append(('Content-Length', str(len(body))))
+        start_response(status, headers)
+        return [body]
+
+    def compressible(self, status, headers):
+        """ Returns True when a response with status and headers may be compressed """
+        code = int(status.split(' ', 1)[0])
+        if code < 200 or code in (204, 206, 304):
+            return False
+        if header_value(headers, 'Content-Encoding') is not None:
+            return False
+        content_type = header_value(headers, 'Content-Type') or ''
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def stream(app_iter, compressor, flush_size=16384):
+    """ Compresses the chunks of app_iter as they come, flushing every flush_size bytes """
+    pending = 0
+    try:
+        for chunk in app_iter:
+            data = compressor.compress(chunk)
+            pending += len(chunk)
+            if pending >= flush_size:
+                data += compressor.flush()
+                pending = 0
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+
+def header_value(headers, name):
+    """ Returns the value of the header name or None """
+    name = name.lower()
+    for header, value in headers:
+        if header.lower() == name:
+            return value
+    return None
+
+def add_vary(headers):
+    """ Adds Accept-Encoding to the Vary header """
+    vary = header_value(headers, 'Vary')
+    if vary is None:
+        return headers + [('Vary', 'Accept-Encoding')]
+    if 'accept-encoding' in vary.lower():
+        return headers
+    return [(name, value) for name, value in headers if name.lower() != 'vary'] + \
+           [('Vary', vary + ', Accept-Encoding')]
+
+def weaken_etag(headers):
+    """ Makes a strong ETag weak, the compressed bytes differ from the original """
+    return [(name, 'W/' + value if name.lower() == 'etag' and not value.startswith('W/') else value)
+            for name, value in headers]
@@ -0,0 +1,28 @@
+"""
+Database drivers of the Promotion Demo Service
+
+Only the driver of the database in SQLALCHEMY_DATABASE_URI is imported,
+when its engine is created. A worker on MySQL or SQLite never loads the
+DB2 client library
+"""
+import logging
+import importlib
+from sqlalchemy.engine.url import make_url
+
+# the packages that provide the dialects which are not part of SQLAlchemy
+DIALECT_PACKAGES = {
+    'db2': 'ibm_db_sa',
+    'ibm_db_sa': 'ibm_db_sa',
+}
+
+def load_driver(uri):
+    """ Imports the dialect package of the database in uri, if it has one """
+    backend = make_url(uri).get_backend_name()
+    package = DIALECT_PACKAGES.get(backend)
+    if package is None:
+        return None
+    logging.getLogger(__name__).info('Loading the %s driver %s', backend, package)
+    try:
+        return importlib.import_module(package)
+    except ImportError as error:
+        raise ImportError('The {} database needs the {} package: {}'.format(backend, package, error))
@@ -0,0 +1,92 @@
+"""
+Readiness of the Promotion Demo Service
+
+ReadinessCheck runs a SELECT 1 through the connection pool and looks at
+how many of the connections are in use. The result is kept for
+READY_CHECK_INTERVAL seconds and only one check runs at a time, so load
+balancer probes never add more than one query per interval to a worker.
+While a check waits for the database the other probes get the last result
+"""
+import time
+import threading
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from pool import pool_status
+
+def pool_saturation(status):
+    """ Returns the share of the connections in use or None when unbounded """
+    if 'checked_out' not in status or status['max_overflow'] < 0:
+        return None
+    capacity = status['size'] + status['max_overflow']
+    return round(float(status['checked_out']) / capacity, 3) if capacity else None
+
+class ReadinessCheck(object):
+    """ A rate limited check of the database and the connection pool """
+
+    def __init__(self, interval=5.0, max_rtt_ms=1000.0, max_saturation=1.0):
+        self.interval = interval
+        self.max_rtt_ms = max_rtt_ms
+        self.max_saturation = max_saturation
+        self._result = None
+        self._checked_at = 0
+        self._checking = False
+        # guards the fields above, never held during a check
+        self._done = threading.Condition(threading.Lock())
+
+    def run(self, engine, cache):
+        """ Returns the latest result, checking again once it is older than interval """
+        with self._done:
+            # only the very first check has no result to fall back on
+            while self._result is None and self._checking:
+                self._done.wait()
+            due = not self._checking and (self._result is None or
+                                          time.time() - self._checked_at >= self.interval)
+            if due:
+                self._checking = True
+            else:
+                result, checked_at = dict(self._result), self._checked_at
+        if due:
+            fresh = None
+            try:
+                fresh = self._check(engine, cache)
+            finally:
+                with self._done:
+                    if fresh is not None:
+                        self._result = fresh
+                        self._checked_at = time.time()
+                    self._checking = False
+                    self._done.notify_all()
+                    checked_at = self._checked_at
+            result = dict(fresh)
+        result['age_s'] = round(time.time() - checked_at, 3)
+        return result
+
+    def _check(self, engine, cache):
+        """ Measures the round trip of a SELECT 1 and the state of the pool """
+        problems = []
+        database = {'ok': True}
+        start = time.time()
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('SELECT 1')).scalar()
+        except SQLAlchemyError as error:
+            database['ok'] = False
+            database['error'] = str(error)
+            problems.append('database unreachable')
+        database['rtt_ms'] = round((time.time() - start) * 1000, 3)
+        if database['ok'] and database['rtt_ms'] > self.max_rtt_ms:
+            problems.append('database round trip above {} ms'.format(self.max_rtt_ms))
+
+        pool = pool_status(engine)
+        pool['saturation'] = pool_saturation(pool)
+        if pool['saturation'] is not None and pool['saturation'] >= self.max_saturation:
+            problems.append('connection pool saturated')
+
+        cache_stats = cache.stats()
+        return {'ready': not problems,
+                'problems': problems,
+                'database': database,
+                'pool': pool,
+                'cache': {'backend': cache_stats['backend'],
+                          'size': cache_stats['size'],
+                          'warm': cache_stats['size'] > 0}}
@@ -0,0 +1,272 @@
+"""
+Logging of the Promotion Demo Service
+
+Every logger sends its records to one handler on the root logger. By
+default it is a BoundedQueueHandler: the request thread only puts the
+record in a bounded queue and a QueueListener thread writes it to STDOUT
+as JSON (LOG_FORMAT=json) or text. When the queue is full the record is
+dropped and counted, so a slow log sink never stalls a request.
+
+Records logged with extra={'payload': ...} carry a request body. Only
+LOG_PAYLOAD_SAMPLE_RATE of them are kept, the others are counted and
+dropped before they are formatted
+"""
+import os
+import sys
+import json
+import atexit
+import random
+import logging
+import threading
+from datetime import datetime
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    QueueHandler = QueueListener = None
+
+TEXT_FORMAT = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+
+# the attributes of every LogRecord, the others were passed with extra=
+RECORD_ATTRIBUTES = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | \
+                    frozenset(['message', 'asctime'])
+
+
+######################################################################
+#  F O R M A T T E R S
+######################################################################
+
+class JsonFormatter(logging.Formatter):
+    """ Formats a record as one line of JSON with its extra fields """
+
+    def format(self, record):
+        entry = {'time': datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'module': record.module,
+                 'message': record.getMessage()}
+        for name, value in record.__dict__.items():
+            if name not in RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """ The format of the service with the payload of the record appended """
+
+    def format(self, record):
+        text = logging.Formatter.format(self, record)
+        if hasattr(record, 'payload'):
+            text += ' payload={}'.format(json.dumps(record.payload, default=str))
+        return text
+
+
+class PayloadSampler(logging.Filter):
+    """ Keeps a share of the records that carry a payload """
+
+    def __init__(self, rate=1.0):
+        logging.Filter.__init__(self)
+        self.rate = rate
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if not hasattr(record, 'payload') or self.rate >= 1:
+            return True
+        if random.random() < self.rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+######################################################################
+#  Q U E U E   H A N D L E R   A N D   L I S T E N E R
+######################################################################
+
+if QueueHandler is None:
+    # Python 2.7 has no logging.handlers.QueueHandler, these follow the
+    # ones of Python 3 and do only what BoundedQueueHandler needs, it
+    # provides prepare() and enqueue()
+    class QueueHandler(logging.Handler):
+        """ Puts the records in a queue """
+
+        def __init__(self, log_queue):
+            logging.Handler.__init__(self)
+            self.queue = log_queue
+
+        def emit(self, record):
+            try:
+                self.enqueue(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+
+    class QueueListener(object):
+        """ Hands the records of a queue to handlers in a thread """
+        _sentinel = None
+
+        def __init__(self, log_queue, *handlers):
+            self.queue = log_queue
+            self.handlers = handlers
+            self._thread = None
+
+        def start(self):
+            self._thread = threading.Thread(target=self._monitor)
+            self._thread.daemon = True
+            self._thread.start()
+
+        def handle(self, record):
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+        def _monitor(self):
+            while True:
+                record = self.queue.get()
+                if record is self._sentinel:
+                    break
+                self.handle(record)
+
+        def enqueue_sentinel(self):
+            self.queue.put_nowait(self._sentinel)
+
+        def stop(self):
+            self.enqueue_sentinel()
+            self._thread.join()
+            self._thread = None
+
+
+class _Listener(QueueListener):
+    """ A QueueListener that writes the queued records before it stops """
+
+    # seconds close() waits for room in a full queue
+    STOP_TIMEOUT = 5
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel, timeout=self.STOP_TIMEOUT)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    A QueueHandler that never blocks
+
+    The records go to a queue of at most maxsize records that a listener
+    thread writes to sink. Records that do not fit are dropped and
+    counted. After a fork the worker gets a new queue and listener
+    """
+
+    def __init__(self, sink, maxsize=10000):
+        QueueHandler.__init__(self, None)
+        self.sink = sink
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._listener = None
+        self._start()
+
+    def _start(self):
+        """ Starts a listener on a new queue in this process """
+        self.queue = queue.Queue(self.maxsize)
+        self._listener = _Listener(self.queue, self.sink)
+        self._listener.start()
+        self._pid = os.getpid()
+
+    def prepare(self, record):
+        """ Keeps the record as it is, the listener formats it """
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        """ Puts the record in the queue or drops it when the queue is full """
+        if self._pid != os.getpid():
+            # the listener thread of the parent did not survive the fork
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def close(self):
+        """ Writes the records left in the queue and stops the listener """
+        if self._listener is not None and self._pid == os.getpid():
+            try:
+                self._listener.stop()
+            except queue.Full:
+                # the sink is stuck, the daemon thread dies with the process
+                pass
+            self._listener = None
+        QueueHandler.close(self)
+
+    def stats(self):
+        """ Returns the counters of the queue """
+        return {'queued': self.queue.qsize(),
+                'maxsize': self.maxsize,
+                'dropped': self.dropped}
+
+
+######################################################################
+#  S E T U P
+######################################################################
+
+# the handler installed on the root logger by initialize_logging()
+_handler = None
+
+def initialize_logging(app):
+    """ Sends the logs of every logger through one handler on the root logger """
+    global _handler
+    config = app.config
+    gunicorn_logger = logging.getLogger('gunicorn.error')
+    level = gunicorn_logger.level if gunicorn_logger.handlers else config['LOGGING_LEVEL']
+
+    sink = logging.StreamHandler(sys.stdout)
+    if config.get('LOG_FORMAT', 'json') == 'json':
+        sink.setFormatter(JsonFormatter())
+    else:
+        sink.setFormatter(TextFormatter(TEXT_FORMAT))
+    if config.get('LOG_ASYNC', True):
+        handler = BoundedQueueHandler(sink, config.get('LOG_QUEUE_SIZE', 10000))
+    else:
+        handler = sink
+    handler.sampler = PayloadSampler(config.get('LOG_PAYLOAD_SAMPLE_RATE', 1.0))
+    handler.addFilter(handler.sampler)
+
+    if _handler is not None:
+        _handler.close()
+    _handler = handler
+    # also replaces the handler of logging.basicConfig(), which logging.info()
+    # installs when it is called before the logging is set up
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    # Flask logs through the root logger instead of its default handler
+    app.logger.handlers = []
+    app.logger.setLevel(level)
+    app.logger.info('Logging established')
+
+def log_stats():
+    """ Returns the counters of the logging pipeline """
+    if _handler is None:
+        return {}
+    stats = _handler.stats() if isinstance(_handler, BoundedQueueHandler) else {}
+    stats.update(payloads_sampled_out=_handler.sampler.sampled_out)
+    return stats
+
+@atexit.register
+def _flush():
+    """ Writes the queued records when the process exits """
+    if _handler is not None:
+        _handler.close()
@@ -0,0 +1,257 @@
+"""
+Metrics for the Promotion Demo Service
+
+Request counts, latency and response size histograms per endpoint, and
+the number of database queries and the time spent in them per request.
+They are published at /metrics in the Prometheus text format.
+
+Every worker keeps its metrics in memory and, when METRICS_DIR is set,
+writes them at most every METRICS_FLUSH_INTERVAL seconds to its own file
+in that directory. /metrics adds up the files of all of the workers, so
+the numbers are the same whichever gunicorn worker answers the scrape.
+The directory should be emptied when the service (re)starts
+
+The same hooks log the statements slower than SLOW_QUERY_MS and, when
+SERVER_TIMING is set, report the queries of a request in a Server-Timing
+response header
+"""
+import os
+import json
+import time
+import threading
+from flask import g, request, current_app, has_app_context, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# longest parameter list written to the slow query log
+MAX_LOGGED_PARAMETERS = 1000
+
+HELP = {
+    'promotions_http_requests_total': 'Requests by endpoint, method and status',
+    'promotions_http_request_duration_seconds': 'Time to answer a request',
+    'promotions_http_response_size_bytes': 'Size of the response bodies',
+    'promotions_db_queries_per_request': 'Database queries run by a request',
+    'promotions_db_time_per_request_seconds': 'Time a request spent in the database',
+}
+
+class MetricsRegistry(object):
+    """ The counters and histograms of one worker process """
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._counters = {}
+        self._histograms = {}
+        self._flushed_at = 0
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, amount=1):
+        """ Adds amount to the counter name with labels """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value, buckets):
+        """ Records value in the histogram name with labels """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': list(buckets),
+                                                     'counts': [0] * len(buckets),
+                                                     'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][index] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        """ Returns the metrics of this worker as a JSON compatible dictionary """
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value]
+                             for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), dict(histogram, counts=list(histogram['counts']))]
+                               for (name, labels), histogram in self._histograms.items()],
+            }
+
+    def flush(self, force=False):
+        """ Writes the snapshot of this worker to its file in the directory """
+        if not self.directory:
+            return
+        now = time.time()
+        if not force and now - self._flushed_at < self.flush_interval:
+            return
+        self._flushed_at = now
+        path = os.path.join(self.directory, 'metrics-{}.json'.format(os.getpid()))
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump(self.snapshot(), handle)
+        # the rename is atomic so readers never see a partial file
+        os.rename(temporary, path)
+
+    def collect(self):
+        """ Returns the snapshots of all of the workers added together """
+        if not self.directory:
+            return merge([self.snapshot()])
+        self.flush(force=True)
+        snapshots = []
+        for filename in sorted(os.listdir(self.directory)):
+            if filename.startswith('metrics-') and filename.endswith('.json'):
+                try:
+                    with open(os.path.join(self.directory, filename)) as handle:
+                        snapshots.append(json.load(handle))
+                except (IOError, OSError, ValueError):
+                    # a worker that just went away
+                    continue
+        return merge(snapshots)
+
+    def render(self):
+        """ Returns all of the metrics in the Prometheus text format """
+        counters, histograms = self.collect()
+        lines = []
+        for name in sorted(set(name for name, _ in counters)):
+            lines.append('# HELP {} {}'.format(name, HELP.get(name, name)))
+            lines.append('# TYPE {} counter'.format(name))
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append('{}{} {}'.format(name, format_labels(labels), value))
+        for name in sorted(set(name for name, _ in histograms)):
+            lines.append('# HELP {} {}'.format(name, HELP.get(name, name)))
+            lines.append('# TYPE {} histogram'.format(name))
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram['buckets'], histogram['counts']):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(
+                        name, format_labels(labels + (('le', repr(float(bound))),)), cumulative))
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(labels + (('le', '+Inf'),)), histogram['count']))
+                lines.append('{}_sum{} {}'.format(name, format_labels(labels), repr(histogram['sum'])))
+                lines.append('{}_count{} {}'.format(name, format_labels(labels), histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def merge(snapshots):
+    """ Adds snapshots together into dictionaries of counters and histograms """
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in snapshot['histograms']:
+            key = (name, tuple(tuple(label) for label in labels))
+            total = histograms.get(key)
+            if total is None:
+                histograms[key] = dict(histogram, counts=list(histogram['counts']))
+                continue
+            total['counts'] = [a + b for a, b in zip(total['counts'], histogram['counts'])]
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+    return counters, histograms
+
+def format_labels(labels):
+    """ Formats label pairs as {name="value",...} """
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('"', '\\"'))
+                          for name, value in labels) + '}'
+
+# the metrics of this worker process
+registry = MetricsRegistry()
+
+
+######################################################################
+#  R E Q U E S T   A N D   Q U E R Y   H O O K S
+######################################################################
+
+def endpoint_name(app):
+    """ Returns the name of the Resource class or view that handles the request """
+    view = app.view_functions.get(request.endpoint)
+    if view is None:
+        return 'none'
+    view_class = getattr(view, 'view_class', None)
+    # the views of the blueprint without its name
+    return view_class.__name__ if view_class else request.endpoint.rsplit('.', 1)[-1]
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """ Remembers when a statement started """
+    # on the context of the statement, a failed one leaves nothing behind
+    context._query_start = time.time()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """ Adds the statement to the database time of the current request """
+    elapsed = time.time() - context._query_start
+    if has_request_context() and hasattr(g, 'db_queries'):
+        g.db_queries += 1
+        g.db_time += elapsed
+    if has_app_context():
+        threshold = current_app.config.get('SLOW_QUERY_MS')
+        if threshold is not None and elapsed * 1000 >= threshold:
+            log_slow_query(statement, parameters, elapsed)
+
+def log_slow_query(statement, parameters, elapsed):
+    """ Logs a slow statement with its parameters and the request that ran it """
+    if has_request_context():
+        origin = '{} {} ({})'.format(request.method, request.path, endpoint_name(current_app))
+    else:
+        origin = 'no request'
+    logged = repr(parameters)
+    if len(logged) > MAX_LOGGED_PARAMETERS:
+        logged = logged[:MAX_LOGGED_PARAMETERS] + '...'
+    current_app.logger.warning('Slow query %.1f ms from %s: %s parameters=%s',
+                               elapsed * 1000, origin, ' '.join(statement.split()), logged)
+
+def server_timing(db_queries, db_time, total):
+    """ Formats the query count and times of a request as a Server-Timing header """
+    return 'db;desc="{} queries";dur={:.3f}, total;dur={:.3f}'.format(
+        db_queries, db_time * 1000, total * 1000)
+
+def init_app(app):
+    """ Installs the request hooks that record the metrics of app """
+    registry.directory = app.config.get('METRICS_DIR')
+    registry.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', 1.0)
+    if registry.directory and not os.path.isdir(registry.directory):
+        os.makedirs(registry.directory)
+
+    @app.before_request
+    def start_request_metrics():
+        """ Starts the clock and the query counters of the request """
+        g.request_start = time.time()
+        g.db_queries = 0
+        g.db_time = 0.0
+
+    @app.after_request
+    def record_request_metrics(response):
+        """ Records the metrics of the request """
+        if not hasattr(g, 'request_start'):
+            return response
+        elapsed = time.time() - g.request_start
+        endpoint = endpoint_name(app)
+        labels = {'endpoint': endpoint, 'method': request.method}
+        registry.inc('promotions_http_requests_total',
+                     dict(labels, status=response.status_code))
+        registry.observe('promotions_http_request_duration_seconds', labels,
+                         elapsed, LATENCY_BUCKETS)
+        # streamed responses have no length
+        if response.content_length is not None:
+            registry.observe('promotions_http_response_size_bytes', labels,
+                             response.content_length, SIZE_BUCKETS)
+        registry.observe('promotions_db_queries_per_request', labels,
+                         g.db_queries, QUERY_BUCKETS)
+        registry.observe('promotions_db_time_per_request_seconds', labels,
+                         g.db_time, LATENCY_BUCKETS)
+        registry.flush()
+        if app.config.get('SERVER_TIMING'):
+            response.headers['Server-Timing'] = server_timing(g.db_queries, g.db_time, elapsed)
+        return response
@@ -0,0 +1,58 @@
+"""
+Schema migrations for the Promotion Demo Service
+
+db.create_all() only creates the tables that are missing, it never alters
+a table that already exists. The migrations in this module bring an
+existing database up to the schema declared in the models. Every
+migration checks the live schema first so they can be run any number
+of times
+"""
+import logging
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+from . import db
+from .models import Promotion
+from . import search
+
+logger = logging.getLogger(__name__)
+
+def add_missing_columns(connection):
+    """ Adds the columns of the promotion table that do not exist yet """
+    inspector = inspect(connection)
+    existing = set(column['name'] for column in inspector.get_columns(Promotion.__tablename__))
+    for column in Promotion.__table__.columns:
+        if column.name not in existing:
+            logger.info('Adding column %s', column.name)
+            definition = CreateColumn(column).compile(dialect=connection.dialect)
+            connection.execute('ALTER TABLE {} ADD COLUMN {}'.format(
+                Promotion.__tablename__, definition))
+
+def add_missing_indexes(connection):
+    """ Creates the indexes of the promotion table that do not exist yet """
+    inspector = inspect(connection)
+    existing = set(index['name'] for index in inspector.get_indexes(Promotion.__tablename__))
+    for index in sorted(Promotion.__table__.indexes, key=lambda index: index.name):
+        if index.name not in existing:
+            logger.info('Creating index %s', index.name)
+            index.create(connection)
+
+def add_search_index(connection):
+    """ Creates the full text index of the search and fills it """
+    if not search.has_search_index(connection):
+        logger.info('Creating the search index')
+        search.create_search_index(connection)
+
+# The migrations are run in this order
+MIGRATIONS = [
+    add_missing_columns,
+    add_missing_indexes,
+    add_search_index,
+]
+
+def upgrade():
+    """ Creates any missing tables and runs all of the migrations """
+    logger.info('Upgrading the database schema')
+    db.create_all()
+    with db.engine.begin() as connection:
+        for migration in MIGRATIONS:
+            migration(connection)
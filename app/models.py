@@ -12,12 +12,20 @@ category (string) - the category the promotion belongs to (i.e., home, kids)
 price (float) - the price of the goods
 dicount (float) - the discount percentage of the promotion
 available (boolean) - True for promotions that are in use
+version (int) - incremented every time the promotion is updated
+updated_at (datetime) - when the promotion was last changed (UTC)
 """
 import os
 import json
+import math
 import logging
-import ibm_db
+from datetime import datetime
+from sqlalchemy import and_, func, literal_column, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.exc import StaleDataError
 from . import db
+from .cache import create_cache
 
 ######################################################################
 # Custom Exceptions
@@ -25,9 +33,43 @@ from . import db
 class DataValidationError(ValueError):
     pass
 
+class VersionConflictError(Exception):
+    """ Used when a Promotion was changed by someone else since it was read """
+    pass
+
 #class DatabaseConnectionError(ConnectionError):
 #   pass
 
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# dialects that can return the changed row from an UPDATE
+RETURNING_DIALECTS = ('postgresql', 'oracle', 'mssql', 'firebird')
+
+# the text fields of a Promotion
+TEXT_TYPES = (str, type(u''))
+
+# the statements that empty a table and restart its ids, by dialect. DB2
+# only truncates in the first statement of a unit of work
+RESET_STATEMENTS = {
+    'mysql': ['TRUNCATE TABLE {table}'],
+    'postgresql': ['TRUNCATE TABLE {table} RESTART IDENTITY'],
+    'ibm_db_sa': ['TRUNCATE TABLE {table} IMMEDIATE',
+                  'ALTER TABLE {table} ALTER COLUMN id RESTART WITH 1'],
+}
+DEFAULT_RESET_STATEMENTS = ['DELETE FROM {table}']
+
+# dialects that insert a chunk of a bulk save with one statement, the others
+# send one INSERT per row to learn the ids
+MULTI_ROW_INSERT_DIALECTS = ('sqlite', 'mysql', 'postgresql')
+
+def format_timestamp(value):
+    """ Formats a datetime as an ISO 8601 string """
+    return value.strftime(TIMESTAMP_FORMAT) if value else None
+
+def parse_timestamp(value):
+    """ Parses a string made by format_timestamp back into a datetime """
+    return datetime.strptime(value, TIMESTAMP_FORMAT) if value else None
+
 ######################################################################
 # Promotion Model for database
 ######################################################################
@@ -39,15 +81,32 @@ class Promotion(db.Model):
     """
     logger = logging.getLogger(__name__)
     app = None
+    # serialized Promotions by id, see find() and init_cache()
+    cache = None
+    # the fields of a serialized Promotion
+    FIELDS = ('id', 'promo_name', 'goods_name', 'category', 'price', 'discount',
+              'available', 'version', 'updated_at')
+    # the fields that a PUT replaces
+    CHANGEABLE_FIELDS = ('promo_name', 'goods_name', 'category', 'price', 'discount', 'available')
     __tablename__ = 'promotion'
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    promo_name = db.Column(db.String(63))
-    goods_name = db.Column(db.String(63))
+    promo_name = db.Column(db.String(63), index=True)
+    goods_name = db.Column(db.String(63), index=True)
     category = db.Column(db.String(63))
     price = db.Column(db.Float())
     discount= db.Column(db.Float())
-    available = db.Column(db.Boolean())
+    available = db.Column(db.Boolean(), index=True)
+    version = db.Column(db.Integer(), nullable=False, default=1, server_default='1',
+                        onupdate=literal_column('version + 1'))
+    updated_at = db.Column(db.DateTime(), default=datetime.utcnow, onupdate=datetime.utcnow)
+    # category lookups use the leftmost column of the composite index
+    __table_args__ = (
+        db.Index('ix_promotion_category_available', 'category', 'available'),
+    )
+    # the UPDATE and DELETE of the session only match the version that was
+    # read, a Promotion changed in the meantime raises StaleDataError
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return '<Promotion %r>' % (self.name)
@@ -57,17 +116,31 @@ class Promotion(db.Model):
         Saves a Promotion to the data store
         """
         # if the id is None it hasn't been added to the database
+        promotion_id = self.id
         try:
-            if not self.id:
+            if not promotion_id:
                 db.session.add(self)
             db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            Promotion.cache.delete(promotion_id)
+            raise VersionConflictError('Promotion with id {} was changed by another request'.format(promotion_id))
         except:
             raise DataValidationError('Invalid promotion goods: body of request contained bad or no data')
+        if promotion_id:
+            Promotion.cache.delete(promotion_id)
 
     def delete(self):
         """ Removes a Promotion from the data store """
+        promotion_id = self.id
         db.session.delete(self)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            raise VersionConflictError('Promotion with id {} was changed by another request'.format(promotion_id))
+        finally:
+            Promotion.cache.delete(promotion_id)
 
     def serialize(self):
         """ Serializes a Promotion into a dictionary """
@@ -77,7 +150,40 @@ class Promotion(db.Model):
                 "category": self.category,
                 "price": self.price,
                 "discount": self.discount,
-                "available": self.available}
+                "available": self.available,
+                "version": self.version,
+                "updated_at": format_timestamp(self.updated_at)}
+
+    @staticmethod
+    def serialize_row(row, fields):
+        """ Serializes some of the fields of a row into a dictionary
+        Args:
+            row: a Promotion or a row of a column query with these fields
+            fields (list): the names of the fields to include
+        """
+        data = dict((name, getattr(row, name)) for name in fields)
+        if 'updated_at' in data:
+            data['updated_at'] = format_timestamp(data['updated_at'])
+        return data
+
+    @staticmethod
+    def parse_fields(value):
+        """
+        Validates a comma separated list of field names
+
+        Returns:
+            the tuple of field names in the order of Promotion.FIELDS, or
+            None when value is empty
+        Raises:
+            DataValidationError: when a name is not one of Promotion.FIELDS
+        """
+        if not value:
+            return None
+        names = set(name.strip() for name in value.split(','))
+        for name in names:
+            if name not in Promotion.FIELDS:
+                raise DataValidationError('Invalid fields: unknown field {}'.format(name))
+        return tuple(name for name in Promotion.FIELDS if name in names)
 
     def deserialize(self, data):
         """
@@ -86,18 +192,197 @@ class Promotion(db.Model):
             data (dict): A dictionary containing the promotion data
         """
         try:
-            self.promo_name = data['promo_name']
-            self.goods_name = data['goods_name']
-            self.category = data['category']
-            self.price = data['price']
-            self.discount = data['discount']
-            self.available = data['available']
+            for name in Promotion.CHANGEABLE_FIELDS:
+                setattr(self, name, Promotion.parse_field(name, data[name]))
         except KeyError as error:
             raise DataValidationError('Invalid promotion goods: missing ' + error.args[0])
         except TypeError as error:
             raise DataValidationError('Invalid promotion goods: body of request contained bad or no data')
         return self
 
+    @staticmethod
+    def parse_changes(data):
+        """
+        Validates the fields of a partial update
+
+        Only the fields in data are checked, each one as deserialize()
+        would. id, version and updated_at cannot be changed
+        Args:
+            data (dict): some of the fields of a Promotion
+        Returns:
+            a dictionary of the column values to set
+        Raises:
+            DataValidationError: when data is empty or a field is invalid
+        """
+        if not isinstance(data, dict) or not data:
+            raise DataValidationError('Invalid promotion goods: body of request contained no fields')
+        changes = {}
+        for name, value in data.items():
+            if name not in Promotion.CHANGEABLE_FIELDS:
+                raise DataValidationError('Invalid promotion goods: {} cannot be changed'.format(name))
+            changes[name] = Promotion.parse_field(name, value)
+        return changes
+
+    @staticmethod
+    def parse_field(name, value):
+        """
+        Validates the value of one of Promotion.CHANGEABLE_FIELDS
+
+        Returns:
+            the value to store, price and discount as floats
+        Raises:
+            DataValidationError: when value has the wrong type
+        """
+        if name in ('promo_name', 'goods_name', 'category'):
+            if not isinstance(value, TEXT_TYPES):
+                raise DataValidationError('Invalid promotion goods: {} must be a string'.format(name))
+            return value
+        if name in ('price', 'discount'):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                raise DataValidationError('Invalid promotion goods: price and discount must be numbers')
+        if not isinstance(value, bool):
+            raise DataValidationError('Invalid promotion goods: available must be true or false')
+        return value
+
+    @staticmethod
+    def patch(promotion_id, changes, versions=None):
+        """
+        Changes some of the fields of a Promotion with one UPDATE statement
+
+        There is no SELECT before the UPDATE, a missing Promotion is found
+        from the number of rows it changed. The dialects in
+        RETURNING_DIALECTS return the new row from the UPDATE, the others
+        read it back in the same transaction
+        Args:
+            promotion_id (int): the id of the Promotion to change
+            changes (dict): the column values returned by parse_changes()
+            versions (list): when given, only change the Promotion if its
+                version is one of these
+        Returns:
+            the row of the changed Promotion with all of Promotion.FIELDS,
+            or None when there is no Promotion with promotion_id and versions
+        """
+        Promotion.logger.info('Processing patch of id %s ...', promotion_id)
+        table = Promotion.__table__
+        columns = [table.c[name] for name in Promotion.FIELDS]
+        statement = table.update().where(Promotion.version_criteria(promotion_id, versions)).values(**changes)
+        returning = db.engine.dialect.name in RETURNING_DIALECTS
+        if returning:
+            statement = statement.returning(*columns)
+        try:
+            result = db.session.execute(statement)
+            if returning:
+                row = result.fetchone()
+            elif result.rowcount:
+                row = db.session.execute(select(columns).where(table.c.id == promotion_id)).fetchone()
+            else:
+                row = None
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            raise DataValidationError('Invalid promotion goods: body of request contained bad or no data')
+        if row is not None:
+            Promotion.cache.delete(promotion_id)
+        return row
+
+    @staticmethod
+    def remove(promotion_id, versions=None):
+        """
+        Deletes a Promotion by id with one DELETE statement
+        Args:
+            promotion_id (int): the id of the Promotion to delete
+            versions (list): when given, only delete the Promotion if its
+                version is one of these
+        Returns:
+            the number of Promotions that were deleted, 0 or 1
+        """
+        Promotion.logger.info('Processing delete of id %s ...', promotion_id)
+        table = Promotion.__table__
+        count = db.session.execute(table.delete().where(
+            Promotion.version_criteria(promotion_id, versions))).rowcount
+        db.session.commit()
+        Promotion.cache.delete(promotion_id)
+        return count
+
+    @staticmethod
+    def version_criteria(promotion_id, versions=None):
+        """ Returns the WHERE clause of a write to some versions of a Promotion """
+        table = Promotion.__table__
+        if versions is None:
+            return table.c.id == promotion_id
+        return and_(table.c.id == promotion_id, table.c.version.in_(versions))
+
+    @staticmethod
+    def save_all(promotions, chunk_size=1000):
+        """
+        Saves many new Promotions to the data store in one transaction
+
+        The dialects in MULTI_ROW_INSERT_DIALECTS send each chunk of
+        chunk_size Promotions with one statement, see insert_rows(). All of
+        the chunks are committed once, so either all of them are saved or
+        none are
+        Args:
+            promotions (list): the deserialized Promotions to insert
+            chunk_size (int): the number of Promotions to send at a time
+        Returns:
+            the list of the new ids in the same order as promotions
+        """
+        Promotion.logger.info('Saving %d promotions in bulk', len(promotions))
+        multi_row = db.engine.dialect.name in MULTI_ROW_INSERT_DIALECTS
+        ids = []
+        try:
+            for start in range(0, len(promotions), chunk_size):
+                chunk = promotions[start:start + chunk_size]
+                if multi_row:
+                    ids.extend(Promotion.insert_rows([Promotion.serialize_row(promotion, Promotion.CHANGEABLE_FIELDS)
+                                                      for promotion in chunk]))
+                else:
+                    db.session.bulk_save_objects(chunk, return_defaults=True)
+                    ids.extend(promotion.id for promotion in chunk)
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise DataValidationError('Invalid promotion goods: body of request contained bad or no data')
+        for promotion, promotion_id in zip(promotions, ids):
+            promotion.id = promotion_id
+        return ids
+
+    @staticmethod
+    def insert_rows(rows):
+        """
+        Inserts rows into the promotion table with one statement
+
+        SQLite runs an executemany, the transaction holds the lock of the
+        database so the new ids are the last ones. MySQL runs a multi-row
+        INSERT whose ids follow the LAST_INSERT_ID of the statement, and
+        PostgreSQL one that returns them
+        Args:
+            rows (list): the column values of the new Promotions
+        Returns:
+            the list of the new ids in the same order as rows
+        """
+        table = Promotion.__table__
+        now = datetime.utcnow()
+        rows = [dict(row, version=1, updated_at=now) for row in rows]
+        dialect = db.engine.dialect.name
+        if dialect == 'sqlite':
+            db.session.execute(table.insert(), rows)
+            last = db.session.execute(select([func.max(table.c.id)])).scalar()
+            return range(last - len(rows) + 1, last + 1)
+        if dialect == 'postgresql':
+            result = db.session.execute(table.insert().values(rows).returning(table.c.id))
+            return [row.id for row in result]
+        first = db.session.execute(table.insert().values(rows)).lastrowid
+        step = db.session.execute('SELECT @@auto_increment_increment').scalar()
+        return range(first, first + len(rows) * step, step)
+
+    @staticmethod
+    def init_cache(config):
+        """ Creates the cache of serialized Promotions from the configuration """
+        Promotion.cache = create_cache(config)
+
     @staticmethod
     def init_db():
         """ Initializes the database session """
@@ -110,20 +395,237 @@ class Promotion(db.Model):
         Promotion.logger.info('Processing all Promotion goods')
         return Promotion.query.all()
 
+    @staticmethod
+    def parse_filters(args):
+        """
+        Validates the filter query parameters of a list request
+
+        availability is accepted as an alias of available
+        Args:
+            args (dict): the query parameters, unknown ones are ignored
+        Returns:
+            a dictionary of the typed filters to pass to find_by_filters
+        Raises:
+            DataValidationError: when a value is not valid
+        """
+        filters = {}
+        for name in ('category', 'promo_name', 'goods_name'):
+            if args.get(name):
+                filters[name] = args.get(name)
+        available = args.get('available', args.get('availability'))
+        if available:
+            if available.lower() in ('true', '1'):
+                filters['available'] = True
+            elif available.lower() in ('false', '0'):
+                filters['available'] = False
+            else:
+                raise DataValidationError('Invalid filter: available must be true or false')
+        for name in ('min_price', 'max_price', 'min_discount', 'max_discount'):
+            if args.get(name):
+                try:
+                    filters[name] = float(args.get(name))
+                except ValueError:
+                    raise DataValidationError('Invalid filter: {} must be a number'.format(name))
+                # nan matches nothing and inf everything
+                if math.isnan(filters[name]) or math.isinf(filters[name]):
+                    raise DataValidationError('Invalid filter: {} must be a number'.format(name))
+        for low, high in (('min_price', 'max_price'), ('min_discount', 'max_discount')):
+            if low in filters and high in filters and filters[low] > filters[high]:
+                raise DataValidationError('Invalid filter: {} is greater than {}'.format(low, high))
+        return filters
+
+    @staticmethod
+    def find_by_filters(category=None, promo_name=None, goods_name=None, available=None,
+                        min_price=None, max_price=None, min_discount=None, max_discount=None):
+        """ Returns the Promotions that match all of the given filters
+
+        The filters are combined into a single WHERE clause, None means
+        the filter is not used. The ranges include their bounds
+        Args:
+            category (string): the category of the goods
+            promo_name (string): the name of the promotion
+            goods_name (string): the name of the goods
+            available (boolean): True for promotions that are in use
+            min_price, max_price (float): the range of the price
+            min_discount, max_discount (float): the range of the discount
+        """
+        Promotion.logger.info('Processing filtered query ...')
+        criteria = []
+        if category is not None:
+            criteria.append(Promotion.category == category)
+        if available is not None:
+            criteria.append(Promotion.available == available)
+        if promo_name is not None:
+            criteria.append(Promotion.promo_name == promo_name)
+        if goods_name is not None:
+            criteria.append(Promotion.goods_name == goods_name)
+        if min_price is not None:
+            criteria.append(Promotion.price >= min_price)
+        if max_price is not None:
+            criteria.append(Promotion.price <= max_price)
+        if min_discount is not None:
+            criteria.append(Promotion.discount >= min_discount)
+        if max_discount is not None:
+            criteria.append(Promotion.discount <= max_discount)
+        return Promotion.query.filter(*criteria)
+
+    @staticmethod
+    def iter_all(batch_size=1000):
+        """ Iterates over all of the Promotions in id order
+
+        Rows are fetched from a server side cursor batch_size at a time, so
+        memory use stays flat no matter how many Promotions there are
+        Args:
+            batch_size (int): the number of rows to fetch per round trip
+        """
+        Promotion.logger.info('Processing export of all Promotions')
+        return Promotion.query.order_by(Promotion.id).yield_per(batch_size)
+
+    @staticmethod
+    def find_page(query=None, limit=100, after_id=None, fields=None):
+        """ Returns one page of Promotions ordered by id
+
+        Keyset pagination: only rows with an id greater than after_id are
+        read, so the cost of a page does not grow with the size of the table
+        Args:
+            query (Query): the Promotion query to page through, defaults to all
+            limit (int): the maximum number of Promotions in the page
+            after_id (int): the id of the last Promotion of the previous page
+            fields (list): when given, only these columns (plus id and
+                version at the end) are selected with a Core select and
+                plain rows are returned instead of Promotions
+        Returns:
+            a tuple of the list of Promotions and the after_id of the next
+            page, or None if this is the last page
+        """
+        Promotion.logger.info('Processing page of %s after id %s ...', limit, after_id)
+        if query is None:
+            query = Promotion.query
+        if fields:
+            names = list(fields) + [name for name in ('id', 'version') if name not in fields]
+            query = query.with_entities(*[getattr(Promotion, name) for name in names])
+        if after_id is not None:
+            query = query.filter(Promotion.id > after_id)
+        # read one extra row to find out if there is a next page
+        query = query.order_by(Promotion.id).limit(limit + 1)
+        if fields:
+            promotions = db.session.execute(query.statement).fetchall()
+        else:
+            promotions = query.all()
+        if len(promotions) > limit:
+            promotions = promotions[:limit]
+            return promotions, promotions[-1].id
+        return promotions, None
+
+    @staticmethod
+    def patch_matching(filters, changes, dry_run=False):
+        """
+        Changes the same fields of every Promotion that matches filters
+
+        One set based UPDATE in one transaction, the Promotions are not
+        loaded. version and updated_at of every changed row are bumped by
+        the UPDATE, so the ETags of the rows and the pages change with them
+        Args:
+            filters (dict): the filters returned by parse_filters()
+            changes (dict): the column values returned by parse_changes()
+            dry_run (boolean): only count the Promotions that would change
+        Returns:
+            the number of Promotions that matched
+        Raises:
+            DataValidationError: when there is no filter
+        """
+        if not filters:
+            raise DataValidationError('Invalid filter: at least one filter is required')
+        query = Promotion.find_by_filters(**filters)
+        if dry_run:
+            Promotion.logger.info('Counting promotions to patch ...')
+            return query.order_by(None).count()
+        Promotion.logger.info('Processing patch of matching promotions ...')
+        try:
+            count = query.update(changes, synchronize_session=False)
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            raise DataValidationError('Invalid promotion goods: body of request contained bad or no data')
+        if count:
+            Promotion.cache.clear()
+        return count
+
+    @staticmethod
+    def delete_unavailable(chunk_size=None):
+        """
+        Deletes all of the Promotions that are not available
+
+        The rows are removed with set based DELETE statements instead of
+        loading and deleting each Promotion
+        Args:
+            chunk_size (int): when set, delete at most this many rows per
+                transaction so locks are only held briefly on large tables
+        Returns:
+            the number of Promotions that were deleted
+        """
+        Promotion.logger.info('Deleting unavailable promotions')
+        query = Promotion.query.filter(Promotion.available == False)
+        if not chunk_size:
+            count = query.delete(synchronize_session=False)
+            db.session.commit()
+            Promotion.cache.clear()
+            return count
+        count = 0
+        while True:
+            ids = [row.id for row in query.with_entities(Promotion.id).limit(chunk_size)]
+            if not ids:
+                break
+            count += query.filter(Promotion.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            for promotion_id in ids:
+                Promotion.cache.delete(promotion_id)
+        return count
+
     @staticmethod
     def remove_all():
-        """ Delete all promotions in the database """
+        """ Delete all promotions in the database
+
+        The table is emptied with TRUNCATE where the database has it and with
+        DELETE otherwise, then the ids start again at 1. The schema, the
+        indexes and the query plans are kept, only a missing table is created
+        """
         Promotion.logger.info('Deleting all promotions')
-        db.session.remove()
-        db.drop_all()
         db.create_all()
-        #db.session.execute("DELETE FROM promotion;")
+        table = Promotion.__tablename__
+        dialect = db.engine.dialect.name
+        for statement in RESET_STATEMENTS.get(dialect, DEFAULT_RESET_STATEMENTS):
+            db.session.execute(statement.format(table=table))
+        if dialect == 'sqlite' and db.session.execute(
+                "SELECT name FROM sqlite_master WHERE name = 'sqlite_sequence'").first():
+            # only tables with AUTOINCREMENT have a row in sqlite_sequence
+            db.session.execute('DELETE FROM sqlite_sequence WHERE name = :table', {'table': table})
+        db.session.commit()
+        # the deleted rows must not stay in the identity map, new rows reuse their ids
+        db.session.expunge_all()
+        Promotion.cache.clear()
 
     @staticmethod
     def find(promotion_id):
-        """ Finds a Promotion good by it's ID """
+        """ Finds a Promotion good by it's ID
+
+        Lookups are read through Promotion.cache. A cached Promotion is
+        attached to the session without querying the database, it may be
+        older than the row when another worker changed it. Load a Promotion
+        that is going to be changed with Promotion.query.get instead
+        """
         Promotion.logger.info('Processing lookup for id %s ...', promotion_id)
-        return Promotion.query.get(promotion_id)
+        data = Promotion.cache.get(promotion_id)
+        if data is not None:
+            promotion = Promotion(**dict(data, updated_at=parse_timestamp(data['updated_at'])))
+            make_transient_to_detached(promotion)
+            return db.session.merge(promotion, load=False)
+        # a write that lands while we read makes this version stale
+        version = Promotion.cache.version(promotion_id)
+        promotion = Promotion.query.get(promotion_id)
+        if promotion:
+            Promotion.cache.set(promotion_id, promotion.serialize(), version)
+        return promotion
 
     @staticmethod
     def find_or_404(promotion_id):
@@ -0,0 +1,124 @@
+"""
+Database connection pool for the Promotion Demo Service
+
+PooledSQLAlchemy - Flask-SQLAlchemy with the pool options of config.py
+InstrumentedQueuePool - a QueuePool that records how long checkouts take
+
+The counters are kept per worker process, pool_status() reports them
+along with the current state of the pool
+"""
+import os
+import time
+import threading
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from .drivers import load_driver
+
+class PoolStats(object):
+    """ Thread safe counters of the connection pool """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Sets all of the counters back to zero """
+        with self._lock:
+            self.checkouts = 0
+            self.checkout_ms_total = 0.0
+            self.checkout_ms_max = 0.0
+            self.timeouts = 0
+            self.connects = 0
+            self.invalidations = 0
+
+    def record_checkout(self, elapsed_ms):
+        """ Counts a checkout that waited elapsed_ms milliseconds """
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_ms_total += elapsed_ms
+            self.checkout_ms_max = max(self.checkout_ms_max, elapsed_ms)
+
+    def record(self, counter):
+        """ Increments one of the event counters """
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def as_dict(self):
+        """ Returns the counters as a dictionary """
+        with self._lock:
+            average = self.checkout_ms_total / self.checkouts if self.checkouts else 0.0
+            return {'checkouts': self.checkouts,
+                    'checkout_ms_avg': round(average, 3),
+                    'checkout_ms_max': round(self.checkout_ms_max, 3),
+                    'timeouts': self.timeouts,
+                    'connects': self.connects,
+                    'invalidations': self.invalidations}
+
+# the counters of this worker process
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """ A QueuePool that records the checkout latency in pool_stats """
+
+    def connect(self):
+        return self._timed_checkout(super(InstrumentedQueuePool, self).connect)
+
+    def unique_connection(self):
+        return self._timed_checkout(super(InstrumentedQueuePool, self).unique_connection)
+
+    def _timed_checkout(self, checkout):
+        """ Calls checkout and records how long it waited """
+        start = time.time()
+        try:
+            return checkout()
+        except PoolTimeoutError:
+            pool_stats.record('timeouts')
+            raise
+        finally:
+            pool_stats.record_checkout((time.time() - start) * 1000)
+
+
+@event.listens_for(InstrumentedQueuePool, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    """ Counts the new database connections """
+    pool_stats.record('connects')
+
+@event.listens_for(InstrumentedQueuePool, 'invalidate')
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    """ Counts the connections thrown away, e.g., when a pre-ping fails """
+    pool_stats.record('invalidations')
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy that also applies SQLALCHEMY_POOL_PRE_PING and
+    uses the InstrumentedQueuePool wherever a QueuePool would be used.
+    The driver of the database is imported when the engine is created
+    """
+
+    def apply_driver_hacks(self, app, info, options):
+        load_driver(info)
+        super(PooledSQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if app.config.get('SQLALCHEMY_POOL_PRE_PING'):
+            options['pool_pre_ping'] = True
+        # SQLite gets a StaticPool or a NullPool from Flask-SQLAlchemy
+        if 'poolclass' not in options:
+            options['poolclass'] = InstrumentedQueuePool
+
+
+def pool_status(engine):
+    """ Returns the state of the pool of engine and the counters """
+    pool = engine.pool
+    status = {'pid': os.getpid(), 'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(size=pool.size(),
+                      checked_in=pool.checkedin(),
+                      checked_out=pool.checkedout(),
+                      overflow=pool.overflow(),
+                      max_overflow=pool._max_overflow,
+                      timeout=pool.timeout())
+    status.update(pool_stats.as_dict())
+    return status
@@ -0,0 +1,166 @@
+"""
+Search of the Promotions by promo_name and goods_name
+
+The search runs on an index of the database. With a full text index every
+word of a query has to match the start of a word of the name of the
+promotion or of the name of its goods:
+
+* SQLite - an FTS5 table that triggers keep in step with the promotion
+  table, ranked with bm25
+* MySQL - a FULLTEXT index searched IN BOOLEAN MODE, ranked by relevance
+* the others - LIKE on the lower case names, the exact promo_name first.
+  No index helps with a word in the middle of a name, so it scans the table
+
+The FTS5 table and the FULLTEXT index are created with the promotion table,
+migrations.add_search_index adds them to an existing database
+"""
+import re
+from sqlalchemy import Float, and_, case, column, event, func, inspect, or_, select, text
+from . import db
+from .models import Promotion, DataValidationError
+
+# at most this many words of a query are used
+MAX_WORDS = 8
+
+FTS_TABLE = 'promotion_search'
+FULLTEXT_INDEX = 'ft_promotion_names'
+
+# the FTS5 table only stores the index, the text stays in the promotion
+# table. The update trigger only fires when one of the names changes
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE {fts} USING fts5(promo_name, goods_name, "
+    "content='promotion', content_rowid='id')",
+    "CREATE TRIGGER {fts}_insert AFTER INSERT ON promotion BEGIN "
+    "INSERT INTO {fts}(rowid, promo_name, goods_name) "
+    "VALUES (new.id, new.promo_name, new.goods_name); END",
+    "CREATE TRIGGER {fts}_delete AFTER DELETE ON promotion BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, promo_name, goods_name) "
+    "VALUES ('delete', old.id, old.promo_name, old.goods_name); END",
+    "CREATE TRIGGER {fts}_update AFTER UPDATE OF promo_name, goods_name ON promotion BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, promo_name, goods_name) "
+    "VALUES ('delete', old.id, old.promo_name, old.goods_name); "
+    "INSERT INTO {fts}(rowid, promo_name, goods_name) "
+    "VALUES (new.id, new.promo_name, new.goods_name); END",
+    # indexes the rows that were there before the table
+    "INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+]
+
+MYSQL_DDL = [
+    'CREATE FULLTEXT INDEX {index} ON promotion (promo_name, goods_name)',
+]
+
+# a match in promo_name counts twice as much as one in goods_name
+SQLITE_SEARCH = (
+    'SELECT {columns}, bm25({fts}, 2.0, 1.0) AS score '
+    'FROM {fts} JOIN promotion ON promotion.id = {fts}.rowid '
+    'WHERE {fts} MATCH :query '
+    'ORDER BY score, promotion.id LIMIT :limit OFFSET :offset')
+
+# RANK is a reserved word of MySQL 8.0.2 and later
+MYSQL_SEARCH = (
+    'SELECT {columns}, MATCH (promo_name, goods_name) AGAINST (:query IN BOOLEAN MODE) AS score '
+    'FROM promotion '
+    'WHERE MATCH (promo_name, goods_name) AGAINST (:query IN BOOLEAN MODE) '
+    'ORDER BY score DESC, promotion.id LIMIT :limit OFFSET :offset')
+
+
+def parse_query(value):
+    """
+    Returns the lower case words of a search query
+
+    Raises:
+        DataValidationError: when the query has no words
+    """
+    words = re.findall(r'\w+', value or u'', re.UNICODE)[:MAX_WORDS]
+    if not words:
+        raise DataValidationError('Invalid search: q must contain at least one word')
+    return [word.lower() for word in words]
+
+def search(words, limit=100, offset=0):
+    """
+    Returns one page of the Promotions that match all of the words
+
+    Args:
+        words (list): the words returned by parse_query()
+        limit (int): the maximum number of Promotions in the page
+        offset (int): the number of better matches to skip
+    Returns:
+        a tuple of the rows with the columns of Promotion.FIELDS, best match
+        first, and True when there are more results after this page
+    """
+    Promotion.logger.info('Processing search for %s ...', ' '.join(words))
+    dialect = db.engine.dialect.name
+    columns = [Promotion.__table__.c[name] for name in Promotion.FIELDS]
+    # one extra row is read to find out if there is a next page
+    if dialect == 'sqlite':
+        query = u' '.join(u'"{}"*'.format(word) for word in words)
+        statement = text(SQLITE_SEARCH.format(columns=qualified(columns), fts=FTS_TABLE))
+    elif dialect == 'mysql':
+        query = u' '.join(u'+{}*'.format(word) for word in words)
+        statement = text(MYSQL_SEARCH.format(columns=qualified(columns)))
+    else:
+        statement = prefix_search(columns, words).limit(limit + 1).offset(offset)
+        rows = db.session.execute(statement).fetchall()
+        return rows[:limit], len(rows) > limit
+    statement = statement.columns(*(columns + [column('score', Float)]))
+    rows = db.session.execute(statement, {'query': query, 'limit': limit + 1,
+                                          'offset': offset}).fetchall()
+    return rows[:limit], len(rows) > limit
+
+def prefix_search(columns, words):
+    """
+    Returns the select of the Promotions where every one of the lower case
+    words starts a word of the promo_name or of the goods_name
+    """
+    names = [func.lower(Promotion.promo_name), func.lower(Promotion.goods_name)]
+    criteria = []
+    for word in words:
+        word = escape_like(word)
+        criteria.append(or_(*[name.like(pattern, escape='\\') for name in names
+                              for pattern in (word + '%', '% ' + word + '%')]))
+    phrase = u' '.join(words)
+    score = case([(names[0] == phrase, 0),
+                  (names[0].like(escape_like(phrase) + '%', escape='\\'), 1)], else_=2)
+    return select(columns + [score.label('score')]).where(and_(*criteria)) \
+                                                   .order_by(score, Promotion.id)
+
+def escape_like(value):
+    """ Escapes the wildcards of LIKE in value """
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def qualified(columns):
+    """ Returns the comma separated names of columns with their table """
+    return ', '.join('promotion.{}'.format(col.name) for col in columns)
+
+
+######################################################################
+#  S C H E M A
+######################################################################
+
+def has_search_index(connection):
+    """ Returns False when the search index of the database is missing """
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        return FTS_TABLE in inspect(connection).get_table_names()
+    if dialect == 'mysql':
+        return FULLTEXT_INDEX in set(index['name'] for index in
+                                     inspect(connection).get_indexes(Promotion.__tablename__))
+    return True
+
+def create_search_index(connection):
+    """ Creates the search index of the database and indexes every row """
+    dialect = connection.dialect.name
+    statements = {'sqlite': SQLITE_DDL, 'mysql': MYSQL_DDL}.get(dialect, [])
+    for statement in statements:
+        connection.execute(statement.format(fts=FTS_TABLE, index=FULLTEXT_INDEX))
+
+@event.listens_for(Promotion.__table__, 'after_create')
+def _create_search_index(target, connection, **kw):
+    """ Creates the search index with the promotion table """
+    create_search_index(connection)
+
+@event.listens_for(Promotion.__table__, 'before_drop')
+def _drop_search_index(target, connection, **kw):
+    """ Drops the FTS5 table with the promotion table, the triggers go with it """
+    if connection.dialect.name == 'sqlite':
+        connection.execute('DROP TABLE IF EXISTS {}'.format(FTS_TABLE))
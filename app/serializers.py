@@ -0,0 +1,67 @@
+"""
+Fast serialization of Promotion listings
+
+Marshalling a list through the Swagger model walks every field object of
+every row, on top of Promotion.serialize() building each dictionary from
+an ORM instance. The RowSerializer here is compiled once per set of fields
+and turns the plain rows of a Core select() into dictionaries, and dumps()
+encodes them with the fastest JSON library that is installed
+"""
+import json
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# the name of the JSON encoder used by dumps(), for the stats and benchmarks
+if orjson is not None:
+    ENCODER = 'orjson'
+elif ujson is not None:
+    ENCODER = 'ujson'
+else:
+    ENCODER = 'json'
+
+def dumps(data):
+    """ Encodes data as a JSON string """
+    if orjson is not None:
+        return orjson.dumps(data)
+    if ujson is not None:
+        # keep the full precision of prices and discounts
+        return ujson.dumps(data, double_precision=15)
+    return json.dumps(data, separators=(',', ':'))
+
+
+class RowSerializer(object):
+    """
+    Turns rows whose first columns are the given fields into dictionaries
+
+    Extra columns at the end of a row (e.g., the id and version used for
+    paging) are left out. Timestamps are formatted with timestamp_format
+    """
+
+    def __init__(self, fields, timestamp_format):
+        self.fields = tuple(fields)
+        self.timestamp_format = timestamp_format
+        # positions of the columns that need to be formatted
+        self.timestamps = tuple(index for index, name in enumerate(self.fields)
+                                if name == 'updated_at')
+
+    def __call__(self, rows):
+        """ Returns the list of dictionaries of rows """
+        fields = self.fields
+        if not self.timestamps:
+            return [dict(zip(fields, row)) for row in rows]
+        results = []
+        for row in rows:
+            values = list(row[:len(fields)])
+            for index in self.timestamps:
+                if isinstance(values[index], datetime):
+                    values[index] = values[index].strftime(self.timestamp_format)
+            results.append(dict(zip(fields, values)))
+        return results
@@ -4,42 +4,56 @@ Promotion Service with Swagger
 
 Paths:
 ------
-GET /promotions - Returns a list all of the Promotions
+GET /promotions - Returns a page of the Promotions ordered by id
 GET /promotions/{id} - Returns the Promotion with a given id number
 POST /promotions - creates a new Promotion record in the database
 PUT /promotions/{id} - updates a Promotion record in the database
+PATCH /promotions/{id} - changes some of the fields of a Promotion record
+PATCH /promotions?category=... - changes some of the fields of every matching Promotion
 DELETE /promotions/{id} - deletes a Promotion record in the database
 DELETE /promotions/unavailable -deletes all promotions that are not available
+POST /promotions/bulk - creates many Promotions in one transaction
+GET /promotions/export - streams all of the Promotions as newline delimited JSON
+GET /promotions/search?q= - finds Promotions by the words of their names, best match first
 """
 
 import os
-import sys
-import logging
-from flask import Response, jsonify, request, json, url_for, make_response
+import hashlib
+from flask import Blueprint, Response, current_app, jsonify, request, json, url_for, make_response,\
+                  stream_with_context
 from flask_api import status
-from flask_restplus import Api, Resource, fields
-from werkzeug.exceptions import BadRequest, NotFound,\
+from flask_restplus import Api, Resource, fields, marshal
+from werkzeug.http import quote_etag, http_date
+from werkzeug.exceptions import BadRequest, NotFound, PreconditionFailed, PreconditionRequired,\
                         UnsupportedMediaType, InternalServerError # Exception Class
 
-from . import app
-from models import Promotion, DataValidationError  #, DatabaseConnectionError
+from . import db
+from models import Promotion, DataValidationError, VersionConflictError, TIMESTAMP_FORMAT  #, DatabaseConnectionError
+from serializers import RowSerializer, dumps
+from pool import pool_status
+from logs import log_stats
+import metrics
+import search
 
 # Pull options from environment
 DEBUG = (os.getenv('DEBUG', 'False') == 'True')
 PORT = os.getenv('PORT', '5000')
 
+# All of the routes of the service, registered on the app by create_app()
+blueprint = Blueprint('api', __name__)
+
 ######################################################################
 # Get Index
 ######################################################################
-@app.route('/', methods=['GET'])
+@blueprint.route('/', methods=['GET'])
 def index():
     """ Return the home page """
-    return app.send_static_file('index.html')
+    return current_app.send_static_file('index.html')
 
 ######################################################################
 # Configure Swagger before initilaizing it
 ######################################################################
-api = Api(app,
+api = Api(blueprint,
           version='1.0.0',
           title='Promotions REST API Service',
           description='This is a Promotions REST API.',
@@ -65,7 +79,21 @@ promotion_model = api.model('Promotion', {
     'discount': fields.Float(required=True,
                           description='Price to be d'),
     'available': fields.Boolean(required=True,
-                                description='Is the Promotion avaialble now?')
+                                description='Is the Promotion avaialble now?'),
+    'version': fields.Integer(readOnly=True,
+                              description='Incremented every time the Promotion is updated'),
+    'updated_at': fields.String(readOnly=True,
+                                description='When the Promotion was last changed (UTC, ISO 8601)')
+})
+
+# The fields a PATCH may change, all of them optional
+promotion_patch_model = api.model('PromotionPatch', {
+    'promo_name': fields.String(description='The name of the promotion'),
+    'goods_name': fields.String(description='The name of the goods on promotion'),
+    'category': fields.String(description='The category that the promotion belongs to'),
+    'price': fields.Float(description='Actual price of the goods on promotion'),
+    'discount': fields.Float(description='Price to be d'),
+    'available': fields.Boolean(description='Is the Promotion avaialble now?')
 })
 
 ######################################################################
@@ -75,34 +103,73 @@ promotion_model = api.model('Promotion', {
 def request_validation_error(error):
     """ Handles Value Errors from bad data """
     message = error.message or str(error)
-    app.logger.info(message)
+    current_app.logger.info(message)
     return {'status':400, 'error': 'Bad Request', 'message': message}, 400
 
-@app.errorhandler(404)
+@api.errorhandler(VersionConflictError)
+def version_conflict_error(error):
+    """ Handles writes to a Promotion that changed since it was read """
+    message = error.message or str(error)
+    current_app.logger.info(message)
+    return {'status': 412, 'error': 'Precondition Failed', 'message': message}, 412
+
+@blueprint.app_errorhandler(404)
 def not_found(error):
     """ Handles resources not found with 404_NOT_FOUND """
     message = error.message or str(error)
-    app.logger.info(message)
+    current_app.logger.info(message)
     print("dfssdf")
     return jsonify(status=404, error='Not Found', message=message), status.HTTP_404_NOT_FOUND
 
-@app.errorhandler(500)
+@blueprint.app_errorhandler(500)
 def internal_server_error(error):
     """ Handles unexpected server error with 500_SERVER_ERROR """
     message = error.message or str(error)
-    app.logger.info(message)
+    current_app.logger.info(message)
     return jsonify(status=500, error='Internal Server Error', message=message), status.HTTP_500_INTERNAL_SERVER_ERROR
 
 
 ######################################################################
 # GET HEALTH
 ######################################################################
-@app.route('/health', methods=['GET'])
+@blueprint.route('/health', methods=['GET'])
 def health():
     """ Return service health """
     return jsonify(name='Promotions REST API Service - Health',
                    status='OK',
-                   url=url_for('health', _external=True)),status.HTTP_200_OK
+                   url=url_for('.health', _external=True)),status.HTTP_200_OK
+
+
+######################################################################
+# GET READY
+######################################################################
+@blueprint.route('/ready', methods=['GET'])
+def ready():
+    """ Return 200 when the database answers in time and the pool has room """
+    result = current_app.extensions['readiness'].run(db.engine, Promotion.cache)
+    code = status.HTTP_200_OK if result['ready'] else status.HTTP_503_SERVICE_UNAVAILABLE
+    return jsonify(result), code
+
+
+######################################################################
+# GET STATS
+######################################################################
+@blueprint.route('/stats', methods=['GET'])
+def stats():
+    """ Return the counters used to size the service """
+    return jsonify(cache=Promotion.cache.stats(),
+                   pool=pool_status(db.engine),
+                   logging=log_stats()), status.HTTP_200_OK
+
+
+######################################################################
+# GET METRICS
+######################################################################
+@blueprint.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """ Return the request metrics of all of the workers for Prometheus """
+    return Response(metrics.registry.render(),
+                    mimetype='text/plain; version=0.0.4')
 
 
 ######################################################################
@@ -116,6 +183,7 @@ class PromotionResource(Resource):
     Allows the manipulation of a single Promotion
     GET /promotion{id} - Returns a Promotion with the id
     PUT /promotion{id} - Update a Promotion with the id
+    PATCH /promotion{id} - Change some of the fields of a Promotion with the id
     DELETE /promotion{id} -  Deletes a Promotion with the id
     """
 
@@ -124,65 +192,121 @@ class PromotionResource(Resource):
     ######################################################################
     @ns.doc('get_promotion with a given id')
     @ns.response(404, 'Promotion not found')
-    @ns.marshal_with(promotion_model)
+    @ns.response(304, 'Promotion not modified since the ETag or date of the request')
+    @ns.response(200, 'Success', promotion_model)
     def get(self,promotion_id):
         """
         Retrieve a single Promotion
 
-        This endpoint will return a Promotion based on it's id
+        This endpoint will return a Promotion based on it's id.
+        It answers 304 Not Modified when If-None-Match or If-Modified-Since
+        show that the client already has the current version
         """
-        app.logger.info("Request to Retrieve a promotion with id [%s]", promotion_id)
+        current_app.logger.info("Request to Retrieve a promotion with id [%s]", promotion_id)
         promotion = Promotion.find(promotion_id)
         if not promotion:
-            app.logger.error('Promotion with id %d was not found.', promotion_id)
+            current_app.logger.error('Promotion with id %d was not found.', promotion_id)
             raise NotFound("Promotion with id '{}' was not found.".format(promotion_id))
-        return promotion.serialize(), status.HTTP_200_OK
+        etag = promotion_etag(promotion)
+        headers = validator_headers(etag, promotion.updated_at)
+        if not_modified(etag, promotion.updated_at):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return marshal(promotion.serialize(), promotion_model), status.HTTP_200_OK, headers
 
 
     ######################################################################
     # UPDATE AN EXISTING PROMOTION
     ######################################################################
     @ns.doc('update_promotions')
+    @ns.header('If-Match', 'The ETag of the Promotion the update was made from')
     @ns.response(404, 'Promotion not found')
     @ns.response(400, 'The posted Promotion data was not valid')
+    @ns.response(412, 'The Promotion changed since the ETag of If-Match')
+    @ns.response(428, 'If-Match is required and was not sent')
     @ns.expect(promotion_model)
     @ns.marshal_with(promotion_model)
     def put(self,promotion_id):
         """
         Update a Promotion
-        This endpoint will update a Promotion based the body that is posted
+        This endpoint will update a Promotion based the body that is posted.
+        Like PATCH it is a single UPDATE statement, with If-Match it only
+        updates the version of that ETag
         """
-        app.logger.info('Request to Update a promotion with id [%s]', promotion_id)
+        current_app.logger.info('Request to Update a promotion with id [%s]', promotion_id)
         check_content_type('application/json')
-        promotion = Promotion.find(promotion_id)
-        if not promotion:
-            app.logger.error('Promotion with id %d was not found.', promotion_id)
+        versions = if_match_versions(promotion_id)
+        data = api.payload
+        current_app.logger.info('Update payload', extra={'payload': data})
+        promotion = Promotion().deserialize(data)
+        changes = dict((name, getattr(promotion, name)) for name in Promotion.CHANGEABLE_FIELDS)
+        row = Promotion.patch(promotion_id, changes, versions)
+        if row is None and versions is not None:
+            raise PreconditionFailed('Promotion with id {} is not at the version of If-Match'.format(
+                promotion_id))
+        if row is None:
+            current_app.logger.error('Promotion with id %d was not found.', promotion_id)
             raise NotFound("Promotion with id '{}' was not found.".format(promotion_id))
+        return Promotion.serialize_row(row, Promotion.FIELDS), status.HTTP_200_OK, \
+               validator_headers(promotion_etag(row), row.updated_at)
 
-        data = api.payload
-        app.logger.info(data)
-        promotion.deserialize(data)
-        promotion.id = promotion_id
-        promotion.save()
-        return promotion.serialize(), status.HTTP_200_OK
 
 
 
+    ######################################################################
+    # PARTIALLY UPDATE A PROMOTION
+    ######################################################################
+    @ns.doc('patch_promotions')
+    @ns.header('If-Match', 'The ETag of the Promotion the changes were made from')
+    @ns.response(404, 'Promotion not found')
+    @ns.response(400, 'The posted Promotion data was not valid')
+    @ns.response(412, 'The Promotion changed since the ETag of If-Match')
+    @ns.response(428, 'If-Match is required and was not sent')
+    @ns.expect(promotion_patch_model)
+    @ns.marshal_with(promotion_model)
+    def patch(self, promotion_id):
+        """
+        Partially update a Promotion
+        This endpoint changes only the fields in the body, with a single
+        UPDATE statement and no read of the Promotion beforehand. The
+        version of the If-Match ETag is part of the WHERE clause
+        """
+        current_app.logger.info('Request to Patch a promotion with id [%s]', promotion_id)
+        check_content_type('application/json')
+        versions = if_match_versions(promotion_id)
+        data = api.payload
+        current_app.logger.info('Patch payload', extra={'payload': data})
+        changes = Promotion.parse_changes(data)
+        row = Promotion.patch(promotion_id, changes, versions)
+        if row is None and versions is not None:
+            raise PreconditionFailed('Promotion with id {} is not at the version of If-Match'.format(
+                promotion_id))
+        if row is None:
+            current_app.logger.error('Promotion with id %d was not found.', promotion_id)
+            raise NotFound("Promotion with id '{}' was not found.".format(promotion_id))
+        return Promotion.serialize_row(row, Promotion.FIELDS), status.HTTP_200_OK, \
+               validator_headers(promotion_etag(row), row.updated_at)
+
 
     ######################################################################
     # DELETE A PROMOTION
     ######################################################################
     @ns.doc('delete_promotion')
+    @ns.header('If-Match', 'The ETag of the Promotion to delete')
     @ns.response(204, 'Promotion deleted')
+    @ns.response(412, 'The Promotion changed since the ETag of If-Match')
+    @ns.response(428, 'If-Match is required and was not sent')
     def delete(self,promotion_id):
         """
         Delete a Promotion
-        This endpoint will delete a Promotion based the id specified in the path
+        This endpoint will delete a Promotion based the id specified in the path.
+        With If-Match it only deletes the version of that ETag
         """
-        app.logger.info('Request to Delete a promotion with id [%s]', promotion_id)
-        promotion = Promotion.find(promotion_id)
-        if promotion:
-            promotion.delete()
+        current_app.logger.info('Request to Delete a promotion with id [%s]', promotion_id)
+        versions = if_match_versions(promotion_id)
+        count = Promotion.remove(promotion_id, versions)
+        if not count and versions is not None:
+            raise PreconditionFailed('Promotion with id {} is not at the version of If-Match'.format(
+                promotion_id))
         return '', status.HTTP_204_NO_CONTENT
 
 
@@ -200,27 +324,52 @@ class PromotionCollection(Resource):
     @ns.doc('list_promotions')
     @ns.param('category', 'List Promotions by category')
     @ns.param('promo_name', 'List Promotions by name')
-    @ns.param('available', 'List Promotions by availability')
-    @ns.marshal_with(promotion_model)
+    @ns.param('goods_name', 'List Promotions by the name of the goods')
+    @ns.param('available', 'List Promotions by availability (true or false)')
+    @ns.param('availability', 'Deprecated alias of available')
+    @ns.param('min_price', 'List Promotions with a price of at least this')
+    @ns.param('max_price', 'List Promotions with a price of at most this')
+    @ns.param('min_discount', 'List Promotions with a discount of at least this')
+    @ns.param('max_discount', 'List Promotions with a discount of at most this')
+    @ns.param('fields', 'Comma separated list of the fields to return, e.g. id,discount,available')
+    @ns.param('limit', 'The maximum number of Promotions to return')
+    @ns.param('after_id', 'Only return Promotions with an id greater than this')
+    @ns.response(400, 'The filter, fields or pagination parameters were not valid')
+    @ns.response(304, 'The page has not changed since the ETag of the request')
+    @ns.response(200, 'Success', [promotion_model])
     def get(self):
-        """ Returns all of the Promotions"""
-        app.logger.info("Request to list promotions")
-        promotions = []
-        category = request.args.get('category')
-        name = request.args.get('promo_name')
-        availability = request.args.get('availability')
-        if category:
-            promotions = Promotion.find_by_category(category)
-        elif name:
-            promotions = Promotion.find_by_promo_name(name)
-        elif availability:
-            availability = str_to_bool(availability)
-            promotions = Promotion.find_by_availability(availability)
-        else:
-            promotions = Promotion.all()
-
-        results = [promotion.serialize() for promotion in promotions]
-        return results, status.HTTP_200_OK
+        """
+        Returns all of the Promotions
+
+        Any combination of the filters can be used, a Promotion has to match
+        all of them. Results are ordered by id and paginated. When there are
+        more results a Link header with rel="next" points at the next page.
+        The ETag of a page changes when any Promotion in it changes.
+        With fields only those columns are read and returned
+        """
+        # rows are read with a Core select and encoded without marshalling,
+        # promotion_model above still documents what they look like
+        current_app.logger.info("Request to list promotions")
+        limit = get_int_arg('limit', current_app.config['DEFAULT_PAGE_LIMIT'])
+        if limit < 1 or limit > current_app.config['MAX_PAGE_LIMIT']:
+            raise BadRequest('limit must be between 1 and {}'.format(current_app.config['MAX_PAGE_LIMIT']))
+        after_id = get_int_arg('after_id')
+        filters = Promotion.parse_filters(request.args)
+        fields = Promotion.parse_fields(request.args.get('fields')) or Promotion.FIELDS
+        query = Promotion.find_by_filters(**filters)
+
+        promotions, next_id = Promotion.find_page(query, limit, after_id, fields)
+        etag = page_etag(promotions, next_id, fields)
+        headers = validator_headers(etag)
+        if next_id is not None:
+            args = request.args.to_dict()
+            args.update(limit=limit, after_id=next_id)
+            next_url = api.url_for(PromotionCollection, _external=True, **args)
+            headers['Link'] = '<{}>; rel="next"'.format(next_url)
+        if not_modified(etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(dumps(row_serializer(fields)(promotions)), status=status.HTTP_200_OK,
+                        mimetype='application/json', headers=headers)
 
 
     ######################################################################
@@ -236,15 +385,52 @@ class PromotionCollection(Resource):
         Create a new promotion
         This endpoint will create a promotion based on the data in the request body and save it into the db
         """
-        app.logger.info('Request to Create a Promotion')
+        current_app.logger.info('Request to Create a Promotion')
         check_content_type('application/json')
         promotion = Promotion()
-        app.logger.info('Payload = %s', api.payload)
+        current_app.logger.info('Create payload', extra={'payload': api.payload})
         promotion.deserialize(api.payload)
         promotion.save()
-        app.logger.info('Promotion with new id [%s] saved!', promotion.id)
+        current_app.logger.info('Promotion with new id [%s] saved!', promotion.id)
         location_url = api.url_for(PromotionResource, promotion_id=promotion.id, _external=True)
-        return promotion.serialize(), status.HTTP_201_CREATED, { 'Location': location_url }
+        headers = validator_headers(promotion_etag(promotion), promotion.updated_at)
+        headers['Location'] = location_url
+        return promotion.serialize(), status.HTTP_201_CREATED, headers
+
+
+    ######################################################################
+    # PARTIALLY UPDATE THE MATCHING PROMOTIONS
+    ######################################################################
+    @ns.doc('patch_matching_promotions')
+    @ns.param('category', 'Change the Promotions of this category')
+    @ns.param('promo_name', 'Change the Promotions with this name')
+    @ns.param('goods_name', 'Change the Promotions of these goods')
+    @ns.param('available', 'Change the Promotions with this availability (true or false)')
+    @ns.param('min_price', 'Change the Promotions with a price of at least this')
+    @ns.param('max_price', 'Change the Promotions with a price of at most this')
+    @ns.param('min_discount', 'Change the Promotions with a discount of at least this')
+    @ns.param('max_discount', 'Change the Promotions with a discount of at most this')
+    @ns.param('dry_run', 'true to only count the Promotions that would change')
+    @ns.expect(promotion_patch_model)
+    @ns.response(400, 'No filter was given or the filters or the body were not valid')
+    @ns.response(200, 'The number of Promotions that matched the filters')
+    def patch(self):
+        """
+        Partially update all of the matching Promotions
+        This endpoint takes the same filters as the list and sets the fields
+        in the body on every Promotion that matches all of them, with one
+        UPDATE in one transaction. At least one filter is required
+        """
+        current_app.logger.info('Request to Patch the matching promotions')
+        check_content_type('application/json')
+        filters = Promotion.parse_filters(request.args)
+        dry_run = request.args.get('dry_run', '').lower() in ('true', '1')
+        data = api.payload
+        current_app.logger.info('Patch payload', extra={'payload': data})
+        changes = Promotion.parse_changes(data)
+        count = Promotion.patch_matching(filters, changes, dry_run)
+        current_app.logger.info('Patched %d promotions (dry run: %s)', count, dry_run)
+        return {'count': count, 'dry_run': dry_run}, status.HTTP_200_OK
 
 
 
@@ -259,24 +445,137 @@ class UnavailableResource(Resource):
     # DELETE UNAVILABLE PROMOTIONS
     #######################################################
     @ns.doc('promotions_unavailable')
-    @ns.response(204, 'Unavailabe promotions deleted')
+    @ns.response(204, 'Unavailabe promotions deleted, the X-Deleted-Count header has the number removed')
     def delete(self):
         """ Delete all unavailable Promotions
 
         This endpoint will delete all unavailable Promotions
         """
-        promotions = Promotion.find_by_availability(False)
-        if promotions:
-            for promotion in promotions:
-                promotion.delete()
-        return '', status.HTTP_204_NO_CONTENT
+        count = Promotion.delete_unavailable(current_app.config['UNAVAILABLE_DELETE_CHUNK_SIZE'])
+        current_app.logger.info('Deleted %d unavailable promotions', count)
+        return '', status.HTTP_204_NO_CONTENT, {'X-Deleted-Count': str(count)}
+
+
+
+######################################################################
+#  PATH: /promotions/bulk
+######################################################################
+@ns.route('/bulk')
+class BulkResource(Resource):
+    """ Handles the creation of many Promotions at once """
+
+    #######################################################
+    # CREATE PROMOTIONS IN BULK
+    #######################################################
+    @ns.doc('create_promotions_in_bulk')
+    @ns.expect([promotion_model])
+    @ns.response(400, 'One or more of the posted Promotions was not valid')
+    @ns.response(201, 'Promotions created successfully')
+    def post(self):
+        """
+        Create many Promotions
+
+        This endpoint accepts a JSON array or newline delimited JSON
+        (application/x-ndjson) of Promotions. Every item is validated first
+        and all of them are inserted in a single transaction. If any item is
+        not valid nothing is saved and the errors are returned per item
+        """
+        items = get_bulk_payload()
+        current_app.logger.info('Request to Create %d Promotions in bulk', len(items))
+        if len(items) > current_app.config['BULK_MAX_ITEMS']:
+            raise BadRequest('At most {} Promotions can be created at once'.format(
+                current_app.config['BULK_MAX_ITEMS']))
+        promotions = []
+        errors = []
+        for index, item in enumerate(items):
+            try:
+                promotions.append(Promotion().deserialize(item))
+            except DataValidationError as error:
+                errors.append({'index': index, 'message': str(error)})
+        if errors:
+            current_app.logger.info('Rejected bulk create with %d invalid Promotions', len(errors))
+            return {'status': 400, 'error': 'Bad Request',
+                    'message': 'Invalid promotion goods: no Promotions were saved',
+                    'errors': errors}, status.HTTP_400_BAD_REQUEST
+        ids = Promotion.save_all(promotions, current_app.config['BULK_CHUNK_SIZE'])
+        current_app.logger.info('Saved %d Promotions in bulk', len(ids))
+        return {'count': len(ids), 'ids': ids}, status.HTTP_201_CREATED
+
+
+######################################################################
+#  PATH: /promotions/export
+######################################################################
+@ns.route('/export')
+class ExportResource(Resource):
+    """ Streams the whole Promotion catalog """
+
+    #######################################################
+    # EXPORT ALL PROMOTIONS
+    #######################################################
+    @ns.doc('export_promotions')
+    @ns.response(200, 'Newline delimited JSON')
+    def get(self):
+        """ Export all of the Promotions
+
+        This endpoint streams every Promotion as one JSON document per line.
+        Rows are written as they are read from the database, the stream is
+        compressed on the fly when the Accept-Encoding header allows it
+        """
+        current_app.logger.info('Request to export all promotions')
+        rows = (json.dumps(promotion.serialize()) + '\n'
+                for promotion in Promotion.iter_all(current_app.config['EXPORT_BATCH_SIZE']))
+        return Response(stream_with_context(rows), status=status.HTTP_200_OK,
+                        mimetype='application/x-ndjson')
+
+
+######################################################################
+#  PATH: /promotions/search
+######################################################################
+@ns.route('/search')
+class SearchResource(Resource):
+    """ Finds Promotions by the words of their names """
+
+    #######################################################
+    # SEARCH PROMOTIONS
+    #######################################################
+    @ns.doc('search_promotions')
+    @ns.param('q', 'The words to find in promo_name and goods_name')
+    @ns.param('limit', 'The maximum number of Promotions to return')
+    @ns.param('offset', 'The number of better matches to skip')
+    @ns.response(400, 'The query or the pagination parameters were not valid')
+    @ns.response(200, 'Success', [promotion_model])
+    def get(self):
+        """ Search the Promotions
 
+        Every word of q has to be the start of a word of the promo_name or
+        of the goods_name of a Promotion. The results come from the full
+        text index of the database, best match first, and are paginated.
+        When there are more results a Link header with rel="next" points
+        at the next page
+        """
+        current_app.logger.info('Request to search promotions')
+        words = search.parse_query(request.args.get('q'))
+        limit = get_int_arg('limit', current_app.config['DEFAULT_PAGE_LIMIT'])
+        if limit < 1 or limit > current_app.config['MAX_PAGE_LIMIT']:
+            raise BadRequest('limit must be between 1 and {}'.format(current_app.config['MAX_PAGE_LIMIT']))
+        offset = get_int_arg('offset', 0)
+        if offset < 0:
+            raise BadRequest('offset must not be negative')
+        promotions, more = search.search(words, limit, offset)
+        headers = {}
+        if more:
+            args = request.args.to_dict()
+            args.update(limit=limit, offset=offset + limit)
+            next_url = api.url_for(SearchResource, _external=True, **args)
+            headers['Link'] = '<{}>; rel="next"'.format(next_url)
+        return Response(dumps(row_serializer(Promotion.FIELDS)(promotions)), status=status.HTTP_200_OK,
+                        mimetype='application/json', headers=headers)
 
 
 ######################################################################
 # DELETE ALL PROMOTIONS DATA (for testing only)
 ######################################################################
-@app.route('/promotions/reset', methods=['DELETE'])
+@blueprint.route('/promotions/reset', methods=['DELETE'])
 def promotions_reset():
     """ Removes all promotions from the database """
     Promotion.remove_all()
@@ -296,30 +595,121 @@ def check_content_type(content_type):
     """ Validate the content type of request """
     if (request.headers['Content-Type'] == content_type):
         return
-    app.logger.error('Invalid Content_Type: %s', request.headers['Content-Type'])
+    current_app.logger.error('Invalid Content_Type: %s', request.headers['Content-Type'])
     raise UnsupportedMediaType('Content-Type must be {}'.format(content_type))
 
-def str_to_bool(str):
-    if str.lower() == 'true':
-        return True
+def get_int_arg(name, default=None):
+    """ Returns an integer query parameter or raises a BadRequest """
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        current_app.logger.error('Invalid %s: %s', name, value)
+        raise BadRequest('{} must be an integer'.format(name))
+
+# RowSerializers by fields, parse_fields keeps the fields in a fixed order
+# so there is at most one per subset of Promotion.FIELDS
+ROW_SERIALIZERS = {}
+
+def row_serializer(fields):
+    """ Returns the RowSerializer of a tuple of fields """
+    if fields not in ROW_SERIALIZERS:
+        ROW_SERIALIZERS[fields] = RowSerializer(fields, TIMESTAMP_FORMAT)
+    return ROW_SERIALIZERS[fields]
+
+def promotion_etag(promotion):
+    """ Returns the strong ETag of a Promotion, it changes with every update """
+    return '{}-{}'.format(promotion.id, promotion.version)
+
+def page_etag(promotions, next_id=None, fields=None):
+    """ Returns the ETag of a page of Promotions from their ids and versions """
+    digest = hashlib.md5()
+    for promotion in promotions:
+        digest.update('{}-{},'.format(promotion.id, promotion.version))
+    digest.update('next-{}'.format(next_id))
+    if fields:
+        digest.update('fields-{}'.format(','.join(fields)))
+    return digest.hexdigest()
+
+def validator_headers(etag, last_modified=None):
+    """ Returns the ETag and Last-Modified response headers """
+    headers = {'ETag': quote_etag(etag)}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+def not_modified(etag, last_modified=None):
+    """
+    Checks the conditional headers of the request
+
+    If-None-Match is compared with etag when it is sent, otherwise
+    If-Modified-Since is compared with last_modified
+    Returns:
+        True if the client already has the current representation
+    """
+    if request.if_none_match:
+        # weak comparison, the compression middleware weakens the ETags it sends
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        # HTTP dates have no fractions of a second
+        return last_modified.replace(microsecond=0) <= \
+               request.if_modified_since.replace(tzinfo=None)
     return False
 
-def initialize_logging(log_level=logging.INFO):
-    """ Initialized the default logging to STDOUT """
-    if not app.debug:
-        print 'Setting up logging...'
-        # Set up default logging for submodules to use STDOUT
-        # datefmt='%m/%d/%Y %I:%M:%S %p'
-        fmt = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
-        logging.basicConfig(stream=sys.stdout, level=log_level, format=fmt)
-        # Make a new log handler that uses STDOUT
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setFormatter(logging.Formatter(fmt))
-        handler.setLevel(log_level)
-        # Remove the Flask default handlers and use our own
-        handler_list = list(app.logger.handlers)
-        for log_handler in handler_list:
-            app.logger.removeHandler(log_handler)
-        app.logger.addHandler(handler)
-        app.logger.setLevel(log_level)
-        app.logger.info('Logging handler established')
+def if_match_versions(promotion_id):
+    """
+    Returns the versions of a Promotion that If-Match allows a write to
+
+    Only the version of an ETag is compared, so the weak ETag of a
+    compressed response matches too: the version column makes sure the
+    write applies to that version. The ETags of other Promotions never match
+    Returns:
+        the list of versions, or None when any version may be written
+        (there is no If-Match or it is *)
+    Raises:
+        PreconditionRequired: when REQUIRE_IF_MATCH is set and If-Match is missing
+        PreconditionFailed: when none of the ETags can match the Promotion
+    """
+    if_match = request.if_match
+    if not if_match:
+        if current_app.config['REQUIRE_IF_MATCH']:
+            raise PreconditionRequired('If-Match with the ETag of the Promotion is required')
+        return None
+    if if_match.star_tag:
+        return None
+    versions = []
+    for etag in if_match.as_set(include_weak=True):
+        etag_id, _, version = etag.partition('-')
+        if etag_id == str(promotion_id) and version.isdigit():
+            versions.append(int(version))
+    if not versions:
+        raise PreconditionFailed('If-Match has no ETag of Promotion with id {}'.format(promotion_id))
+    return versions
+
+def get_bulk_payload():
+    """
+    Returns the list of items posted as a JSON array or as NDJSON
+
+    NDJSON lines that are not valid JSON are returned as None so they
+    are reported along with the other per item validation errors
+    """
+    content_type = request.headers.get('Content-Type', '').split(';')[0].strip()
+    if content_type == 'application/json':
+        items = request.get_json()
+        if not isinstance(items, list):
+            raise BadRequest('Body must be a JSON array of Promotions')
+        return items
+    if content_type == 'application/x-ndjson':
+        items = []
+        for line in request.get_data().splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        return items
+    current_app.logger.error('Invalid Content_Type: %s', content_type)
+    raise UnsupportedMediaType('Content-Type must be application/json or application/x-ndjson')
@@ -0,0 +1,5 @@
+"""
+Package: benchmarks
+Performance benchmarks for the Promotions service.
+Run them from the root of the repo, e.g.: python -m benchmarks.bench_indexes
+"""
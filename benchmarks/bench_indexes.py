@@ -0,0 +1,75 @@
+"""
+Index Benchmark
+
+Measures the filtered list queries of the Promotion model on a table
+without indexes (full scans) and again after the indexes declared on
+the model have been created.
+
+Usage:
+    python -m benchmarks.bench_indexes [--rows 1000000] [--db path]
+"""
+import os
+import argparse
+from sqlalchemy import MetaData, select, func
+from app.models import Promotion
+from benchmarks.common import sqlite_engine, seed, timed, report
+
+PAGE_SIZE = 100
+
+def queries(table):
+    """ The filters used by the list endpoint with one page of results """
+    columns = table.c
+    page = lambda criteria: select([columns.id]).where(criteria).order_by(columns.id).limit(PAGE_SIZE)
+    everything = lambda criteria: select([func.count()]).select_from(table).where(criteria)
+    return {
+        'category_page': page(columns.category == 'Dairy'),
+        'promo_name_page': page(columns.promo_name == 'Clearance'),
+        'category_available_page': page((columns.category == 'Dairy') & (columns.available == False)),
+        'category_count': everything(columns.category == 'Dairy'),
+        'promo_name_count': everything(columns.promo_name == 'Clearance'),
+        'category_available_count': everything((columns.category == 'Dairy') & (columns.available == False)),
+    }
+
+def run(engine, table, repeat):
+    """ Returns the best time of every query in milliseconds """
+    results = {}
+    for name, query in sorted(queries(table).items()):
+        results[name] = timed(lambda: engine.execute(query).fetchall(), repeat)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--db', help='SQLite file to use, a temporary one by default')
+    args = parser.parse_args()
+
+    engine, path = sqlite_engine(args.db)
+    # a copy of the promotion table without any of its indexes
+    table = Promotion.__table__.tometadata(MetaData())
+    indexes = list(table.indexes)
+    table.indexes.clear()
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+    seed(engine, table, args.rows)
+
+    scan = run(engine, table, args.repeat)
+    create_ms = {}
+    for index in indexes:
+        create_ms[index.name] = timed(lambda: index.create(engine), 1)
+    engine.execute('ANALYZE')
+    indexed = run(engine, table, args.repeat)
+
+    report({
+        'rows': args.rows,
+        'database': 'sqlite',
+        'scan_ms': scan,
+        'index_ms': indexed,
+        'speedup': dict((name, round(scan[name] / max(indexed[name], 0.001), 1)) for name in scan),
+        'index_create_ms': create_ms,
+    })
+    if not args.db:
+        os.remove(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Serialization Benchmark
+
+Compares the two ways of turning a listing into a JSON body:
+  marshal - ORM instances, Promotion.serialize() and the Swagger model
+            marshalling used by flask-restplus, encoded by Flask
+  fast    - rows of a Core select turned into dictionaries by the
+            precompiled RowSerializer and encoded by serializers.dumps
+
+Usage:
+    python -m benchmarks.bench_serialization [--rows 10000 100000]
+"""
+import os
+import argparse
+from flask import json
+from flask_restplus import marshal
+from app import create_app, db
+from app.models import Promotion, TIMESTAMP_FORMAT
+from app.serializers import RowSerializer, dumps, ENCODER
+from app.service import promotion_model
+from benchmarks.common import sqlite_engine, seed, timed, report
+
+def marshal_path(count):
+    """ The ORM and marshal_with path """
+    promotions = Promotion.query.order_by(Promotion.id).limit(count).all()
+    results = marshal([promotion.serialize() for promotion in promotions], promotion_model)
+    return json.dumps(results)
+
+def fast_path(count):
+    """ The Core select and RowSerializer path """
+    serializer = RowSerializer(Promotion.FIELDS, TIMESTAMP_FORMAT)
+    query = Promotion.query.with_entities(*[getattr(Promotion, name) for name in Promotion.FIELDS])
+    rows = db.session.execute(query.order_by(Promotion.id).limit(count).statement).fetchall()
+    return dumps(serializer(rows))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    engine, path = sqlite_engine()
+    app = create_app({'SQLALCHEMY_DATABASE_URI': str(engine.url)})
+    results = {'encoder': ENCODER, 'rows': {}}
+    with app.app_context():
+        db.create_all()
+        seed(db.engine, Promotion.__table__, max(args.rows))
+        for count in args.rows:
+            marshal_ms = timed(lambda: marshal_path(count), args.repeat)
+            db.session.remove()
+            fast_ms = timed(lambda: fast_path(count), args.repeat)
+            db.session.remove()
+            results['rows'][count] = {
+                'marshal_ms': marshal_ms,
+                'fast_ms': fast_ms,
+                'speedup': round(marshal_ms / max(fast_ms, 0.001), 1),
+            }
+    report(results)
+    os.remove(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Helpers shared by the benchmarks
+
+The benchmarks run against a local SQLite file that stands in for the
+MySQL / DB2 databases used in production
+"""
+import os
+import json
+import time
+import random
+import tempfile
+from sqlalchemy import create_engine
+
+CATEGORIES = ['Fruit', 'Vegetable', 'Dairy', 'Bakery', 'Digital Products',
+              'Home', 'Kids', 'Garden', 'Sports', 'Books']
+PROMO_NAMES = ['{}% off'.format(percent) for percent in range(5, 100, 5)] + \
+              ['Buy one get one free', 'Clearance', 'Weekend deal']
+
+def sqlite_engine(path=None):
+    """ Returns an engine on a SQLite file, a new temporary one by default """
+    if path is None:
+        handle, path = tempfile.mkstemp(prefix='promotions-bench-', suffix='.db')
+        os.close(handle)
+    return create_engine('sqlite:///{}'.format(path)), path
+
+def promotion_rows(count, seed=42):
+    """ Generates count random promotion rows """
+    rand = random.Random(seed)
+    for number in range(count):
+        yield {
+            'promo_name': rand.choice(PROMO_NAMES),
+            'goods_name': 'goods-{}'.format(rand.randint(1, count)),
+            'category': rand.choice(CATEGORIES),
+            'price': round(rand.uniform(0.5, 2000), 2),
+            'discount': round(rand.uniform(0.05, 0.95), 2),
+            'available': rand.random() < 0.5,
+        }
+
+def seed(engine, table, count, batch_size=10000):
+    """ Inserts count random promotions into table with executemany """
+    rows = promotion_rows(count)
+    with engine.begin() as connection:
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+            connection.execute(table.insert(), batch)
+
+def timed(function, repeat=5):
+    """ Calls function repeat times and returns the best time in milliseconds """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        elapsed = (time.time() - start) * 1000
+        if best is None or elapsed < best:
+            best = elapsed
+    return round(best, 3)
+
+def report(results):
+    """ Prints the results as JSON """
+    print(json.dumps(results, indent=2, sort_keys=True))
@@ -0,0 +1,268 @@
+"""
+Load Benchmark
+
+Seeds a SQLite file with random promotions and sends a mix of list, get,
+create, update and delete requests from several threads, either through
+the Flask test client in this process or over HTTP to gunicorn workers
+started on the same file. Prints the latency percentiles and the
+throughput of every route as JSON, so runs of two releases can be compared
+
+Usage:
+    python -m benchmarks.load [--rows 1000] [--requests 2000] [--concurrency 4]
+                              [--target client|gunicorn] [--workers 2] [--threads 1]
+                              [--mix list=4,get=10,create=1,update=2,delete=1]
+                              [--output results.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+from benchmarks.common import sqlite_engine, seed, promotion_rows, report
+
+DEFAULT_MIX = 'list=4,get=10,create=1,update=2,delete=1'
+
+def parse_mix(value):
+    """ Parses 'route=weight,...' into a list of (route, weight) """
+    mix = []
+    for item in value.split(','):
+        route, weight = item.split('=')
+        if route not in OPERATIONS:
+            raise argparse.ArgumentTypeError('Unknown route: {}'.format(route))
+        mix.append((route, int(weight)))
+    return mix
+
+def percentile(ordered, share):
+    """ Returns the nearest rank percentile of a sorted list """
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(share * len(ordered))) - 1))
+    return round(ordered[index], 3)
+
+def summarize(latencies, errors, seconds):
+    """ Returns the count, errors, req/s and percentiles of latencies in ms """
+    ordered = sorted(latencies)
+    return {'requests': len(ordered),
+            'errors': errors,
+            'req_per_s': round(len(ordered) / seconds, 1) if seconds else None,
+            'mean_ms': round(sum(ordered) / len(ordered), 3) if ordered else None,
+            'p50_ms': percentile(ordered, 0.50),
+            'p95_ms': percentile(ordered, 0.95),
+            'p99_ms': percentile(ordered, 0.99),
+            'max_ms': round(ordered[-1], 3) if ordered else None}
+
+
+######################################################################
+#  C L I E N T S
+######################################################################
+
+class TestClient(object):
+    """ Sends the requests through the Flask test client """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        """ Returns the status and the body of a request """
+        resp = self.client.open(path, method=method, data=body,
+                                content_type='application/json')
+        return resp.status_code, resp.data
+
+
+class HttpClient(object):
+    """ Sends the requests over a keep-alive HTTP connection """
+
+    def __init__(self, port):
+        self.connection = httplib.HTTPConnection('127.0.0.1', port, timeout=30)
+
+    def request(self, method, path, body=None):
+        """ Returns the status and the body of a request """
+        self.connection.request(method, path, body, {'Content-Type': 'application/json'})
+        resp = self.connection.getresponse()
+        return resp.status, resp.read()
+
+
+######################################################################
+#  O P E R A T I O N S
+######################################################################
+
+def list_promotions(client, state, rand):
+    """ GET a page of promotions of a random category """
+    category = rand.choice(state['categories'])
+    return client.request('GET', '/promotions?category={}&limit=50'.format(category.replace(' ', '%20')))
+
+def get_promotion(client, state, rand):
+    """ GET one of the seeded promotions """
+    return client.request('GET', '/promotions/{}'.format(rand.randint(1, state['rows'])))
+
+def create_promotion(client, state, rand):
+    """ POST a new promotion and remember its id for the deletes """
+    status, body = client.request('POST', '/promotions', json.dumps(state['body'](rand)))
+    if status == 201:
+        with state['lock']:
+            state['created'].append(json.loads(body)['id'])
+    return status, body
+
+def update_promotion(client, state, rand):
+    """ PUT one of the seeded promotions """
+    promotion_id = rand.randint(1, state['rows'])
+    return client.request('PUT', '/promotions/{}'.format(promotion_id), json.dumps(state['body'](rand)))
+
+def delete_promotion(client, state, rand):
+    """ DELETE a promotion created by the run, or create one when there is none """
+    with state['lock']:
+        promotion_id = state['created'].pop() if state['created'] else None
+    if promotion_id is None:
+        return create_promotion(client, state, rand)
+    return client.request('DELETE', '/promotions/{}'.format(promotion_id))
+
+OPERATIONS = {'list': list_promotions,
+              'get': get_promotion,
+              'create': create_promotion,
+              'update': update_promotion,
+              'delete': delete_promotion}
+
+
+######################################################################
+#  R U N N E R
+######################################################################
+
+def run(make_client, mix, total, concurrency, state):
+    """ Sends total requests from concurrency threads and returns the results """
+    routes = [route for route, weight in mix for _ in range(weight)]
+    latencies = dict((route, []) for route, _ in mix)
+    errors = dict((route, 0) for route, _ in mix)
+    remaining = [total]
+    lock = threading.Lock()
+
+    def worker(number):
+        client = make_client()
+        rand = random.Random(number)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            route = rand.choice(routes)
+            start = time.time()
+            try:
+                status, _ = OPERATIONS[route](client, state, rand)
+                failed = status >= 400
+            except (socket.error, httplib.HTTPException):
+                client = make_client()
+                failed = True
+            elapsed = (time.time() - start) * 1000
+            with lock:
+                latencies[route].append(elapsed)
+                if failed:
+                    errors[route] += 1
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+
+    every = [latency for route in latencies for latency in latencies[route]]
+    return {'seconds': round(seconds, 3),
+            'total': summarize(every, sum(errors.values()), seconds),
+            'routes': dict((route, summarize(latencies[route], errors[route], seconds))
+                           for route in latencies)}
+
+def start_gunicorn(database_uri, workers, threads, port):
+    """ Starts gunicorn on the database and waits until it answers """
+    env = dict(os.environ, DATABASE_URI=database_uri)
+    process = subprocess.Popen(
+        [os.path.join(os.path.dirname(sys.executable), 'gunicorn'), '-c', 'gunicorn.conf.py',
+         '--workers', str(workers), '--threads', str(threads),
+         '--bind', '127.0.0.1:{}'.format(port), '--log-level', 'warning', 'run:app'], env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if HttpClient(port).request('GET', '/health')[0] == 200:
+                return process
+        except (socket.error, httplib.HTTPException):
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start on port {}'.format(port))
+
+def free_port():
+    """ Returns a TCP port nobody listens on """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument('--target', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--output', help='also write the results to this file')
+    args = parser.parse_args()
+
+    engine, path = sqlite_engine()
+    database_uri = str(engine.url)
+    os.environ['DATABASE_URI'] = database_uri
+    from app import create_app, db
+    from app.models import Promotion
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_uri})
+    with app.app_context():
+        db.create_all()
+        start = time.time()
+        seed(db.engine, Promotion.__table__, args.rows)
+        seed_seconds = time.time() - start
+        db.session.remove()
+        db.engine.dispose()
+
+    sample = list(promotion_rows(100, seed=7))
+    state = {'rows': args.rows,
+             'categories': sorted(set(row['category'] for row in sample)),
+             'body': lambda rand: rand.choice(sample),
+             'created': [],
+             'lock': threading.Lock()}
+
+    process = None
+    try:
+        if args.target == 'gunicorn':
+            port = free_port()
+            process = start_gunicorn(database_uri, args.workers, args.threads, port)
+            make_client = lambda: HttpClient(port)
+        else:
+            make_client = lambda: TestClient(app)
+        results = run(make_client, args.mix, args.requests, args.concurrency, state)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        os.remove(path)
+
+    results.update(target=args.target,
+                   workers=args.workers if args.target == 'gunicorn' else 1,
+                   threads=args.threads if args.target == 'gunicorn' else args.concurrency,
+                   rows=args.rows,
+                   concurrency=args.concurrency,
+                   mix=dict(args.mix),
+                   seed_seconds=round(seed_seconds, 3))
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Startup Benchmark
+
+Measures the cold start of a worker in a fresh interpreter: the time to
+import every module (with the modules it imports, and without them), the
+time create_app() takes to build the app and the time to open the first
+database connection. Prints the slowest modules, the peak memory and the
+database drivers that were loaded as JSON
+
+Usage:
+    python -m benchmarks.startup [--top 20] [--database-uri sqlite://]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+DRIVER_MODULES = ('ibm_db', 'ibm_db_sa', 'pymysql', 'MySQLdb', 'psycopg2', 'sqlite3')
+
+class ImportTimer(object):
+    """ Records how long the first import of every module takes """
+
+    def __init__(self):
+        self.inclusive = {}
+        self.exclusive = {}
+        self._stack = []
+        self._original = builtins.__import__
+
+    def install(self):
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        builtins.__import__ = self._original
+
+    def _import(self, name, *args, **kwargs):
+        if name in sys.modules:
+            return self._original(name, *args, **kwargs)
+        self._stack.append(0.0)
+        start = time.time()
+        try:
+            return self._original(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            if name not in self.inclusive:
+                self.inclusive[name] = elapsed * 1000
+                self.exclusive[name] = (elapsed - children) * 1000
+
+    def slowest(self, count):
+        """ Returns the count modules with the longest inclusive import time """
+        names = sorted(self.inclusive, key=self.inclusive.get, reverse=True)[:count]
+        return [{'module': name,
+                 'inclusive_ms': round(self.inclusive[name], 3),
+                 'self_ms': round(self.exclusive[name], 3)} for name in names]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--database-uri', default=os.getenv('DATABASE_URI', 'sqlite://'))
+    args = parser.parse_args()
+    os.environ['DATABASE_URI'] = args.database_uri
+
+    timer = ImportTimer()
+    timer.install()
+    start = time.time()
+    from app import create_app, db
+    imported = time.time()
+    app = create_app()
+    built = time.time()
+    timer.uninstall()
+    with app.app_context():
+        db.engine.connect().close()
+        database = db.engine.url.get_backend_name()
+    connected = time.time()
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024
+    print(json.dumps({
+        'database': database,
+        'import_app_ms': round((imported - start) * 1000, 3),
+        'create_app_ms': round((built - imported) * 1000, 3),
+        'first_connection_ms': round((connected - built) * 1000, 3),
+        'total_ms': round((connected - start) * 1000, 3),
+        'max_rss_kb': maxrss,
+        'drivers_loaded': [name for name in DRIVER_MODULES if name in sys.modules],
+        'slowest_imports': timer.slowest(args.top),
+    }, indent=2, sort_keys=True))
+
+if __name__ == '__main__':
+    main()
@@ -7,5 +7,72 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 SQLALCHEMY_DATABASE_URI = get_database_uri()
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of each worker, unset values keep the SQLAlchemy defaults
+SQLALCHEMY_POOL_SIZE = int(os.getenv('DB_POOL_SIZE')) if os.getenv('DB_POOL_SIZE') else None
+SQLALCHEMY_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW')) if os.getenv('DB_MAX_OVERFLOW') else None
+SQLALCHEMY_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT')) if os.getenv('DB_POOL_TIMEOUT') else None
+SQLALCHEMY_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE')) if os.getenv('DB_POOL_RECYCLE') else None
+# test connections on checkout, the databases drop idle connections
+SQLALCHEMY_POOL_PRE_PING = (os.getenv('DB_POOL_PRE_PING', 'True') == 'True')
+
 SECRET_KEY = 'secret-for-dev-only'
 LOGGING_LEVEL = logging.INFO
+
+# Logs are written as JSON (or 'text') by a background thread from a queue
+# of LOG_QUEUE_SIZE records, the records that do not fit are dropped.
+# Only LOG_PAYLOAD_SAMPLE_RATE of the request bodies are logged
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_ASYNC = (os.getenv('LOG_ASYNC', 'True') == 'True')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.01'))
+
+# Pagination of the promotion listings
+DEFAULT_PAGE_LIMIT = int(os.getenv('DEFAULT_PAGE_LIMIT', '100'))
+MAX_PAGE_LIMIT = int(os.getenv('MAX_PAGE_LIMIT', '1000'))
+
+# Number of rows fetched per round trip by the streaming export
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+
+# Compression of the responses of at least COMPRESSION_MIN_SIZE bytes and of
+# the streamed ones, with brotli when it is installed, gzip or deflate
+COMPRESSION_ENABLED = (os.getenv('COMPRESSION_ENABLED', 'True') == 'True')
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_LEVEL = int(os.getenv('COMPRESSION_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '4'))
+# A streamed response is flushed to the client every this many bytes
+COMPRESSION_FLUSH_SIZE = int(os.getenv('COMPRESSION_FLUSH_SIZE', '16384'))
+
+# Limits of the bulk create endpoint
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', '50000'))
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', '1000'))
+
+# PUT, PATCH and DELETE of a promotion answer 428 without an If-Match header
+# that has the ETag of the version they change
+REQUIRE_IF_MATCH = (os.getenv('REQUIRE_IF_MATCH', 'False') == 'True')
+
+# Rows deleted per transaction when purging unavailable promotions (0 = all at once)
+UNAVAILABLE_DELETE_CHUNK_SIZE = int(os.getenv('UNAVAILABLE_DELETE_CHUNK_SIZE', '0'))
+
+# Cache of serialized promotions used by Promotion.find
+# CACHE_BACKEND is 'memory' (one cache per worker) or 'shared' (a file
+# at CACHE_PATH shared by all of the gunicorn workers on the host)
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+CACHE_PATH = os.getenv('CACHE_PATH', None)
+PROMOTION_CACHE_SIZE = int(os.getenv('PROMOTION_CACHE_SIZE', '10000'))
+PROMOTION_CACHE_TTL = int(os.getenv('PROMOTION_CACHE_TTL', '60'))
+
+# Readiness check at /ready, the result is reused for READY_CHECK_INTERVAL seconds
+READY_CHECK_INTERVAL = float(os.getenv('READY_CHECK_INTERVAL', '5'))
+READY_MAX_RTT_MS = float(os.getenv('READY_MAX_RTT_MS', '1000'))
+READY_MAX_POOL_SATURATION = float(os.getenv('READY_MAX_POOL_SATURATION', '1.0'))
+
+# Request metrics published at /metrics. With several gunicorn workers set
+# METRICS_DIR to a directory they share and empty it when the service restarts
+METRICS_DIR = os.getenv('METRICS_DIR', None)
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '1.0'))
+
+# Opt-in query accounting: log the statements slower than SLOW_QUERY_MS
+# milliseconds and send the query count and time of each request in a
+# Server-Timing header
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS')) if os.getenv('SLOW_QUERY_MS') else None
+SERVER_TIMING = (os.getenv('SERVER_TIMING', 'False') == 'True')
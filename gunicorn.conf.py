@@ -0,0 +1,74 @@
+"""
+gunicorn configuration of the Promotions service
+
+    gunicorn -c gunicorn.conf.py run:app
+
+The app is built once in the master (preload_app) and shared copy-on-write
+by the workers. Each worker throws away the database connections it
+inherited and opens its own. The number of workers and of threads per
+worker follow the CPU count unless WEB_CONCURRENCY and GUNICORN_THREADS
+are set.
+
+With more than one worker the promotion cache and the metrics have to be
+shared by the workers, see shared_defaults()
+"""
+import os
+import tempfile
+import multiprocessing
+
+CPUS = multiprocessing.cpu_count()
+
+bind = '0.0.0.0:{}'.format(os.getenv('PORT', '5000'))
+workers = int(os.getenv('WEB_CONCURRENCY', CPUS * 2 + 1))
+# more than one thread makes gunicorn use gthread workers, the threads of a
+# worker share its connection pool so keep DB_POOL_SIZE at least as large
+threads = int(os.getenv('GUNICORN_THREADS', max(2, min(CPUS, 4))))
+preload_app = (os.getenv('GUNICORN_PRELOAD', 'True') == 'True')
+errorlog = '-'
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', None)
+
+
+def shared_defaults(workers):
+    """
+    Returns the settings that several workers need by default
+
+    A cache per worker would keep serving a promotion that another worker
+    changed, and /metrics would only show the worker that answers. The
+    shared cache file and the metrics files go in a new directory on every
+    start, so nothing is left over from the last run
+    """
+    if workers <= 1:
+        return {}
+    runtime_dir = tempfile.mkdtemp(prefix='promotions-')
+    return {'CACHE_BACKEND': 'shared',
+            'CACHE_PATH': os.path.join(runtime_dir, 'cache.db'),
+            'METRICS_DIR': runtime_dir}
+
+# config.py reads the environment when the app is built, after this file
+for name, value in shared_defaults(workers).items():
+    os.environ.setdefault(name, value)
+
+
+def on_starting(server):
+    """ Removes the metrics files of the workers of the last run """
+    metrics_dir = os.getenv('METRICS_DIR')
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for filename in os.listdir(metrics_dir):
+            if filename.startswith('metrics-'):
+                os.remove(os.path.join(metrics_dir, filename))
+
+
+def post_fork(server, worker):
+    """ Gives the worker its own connection pool and counters """
+    from run import app
+    from app import db
+    from app.pool import pool_stats
+    # connections opened by the master must not be shared with the workers
+    db.get_engine(app).dispose()
+    pool_stats.reset()
+
+
+def worker_exit(server, worker):
+    """ Writes the metrics the worker has not flushed yet """
+    from app import metrics
+    metrics.registry.flush(force=True)
@@ -1,16 +1,20 @@
 """
 Promotions RESTFUL service
 Starts the service and initializes logging
+
+gunicorn serves run:app, see gunicorn.conf.py
 """
 
 import os
-from app import app, service
+from app import create_app, service
 
 # Pull options from environment
 HOST = os.getenv('HOST', '0.0.0.0')
 DEBUG = (os.getenv('DEBUG', 'False') == 'True')
 PORT = os.getenv('PORT', '5000')
 
+app = create_app()
+
 ######################################################################
 #   M A I N
 ######################################################################
@@ -18,6 +22,6 @@ if __name__ == "__main__":
     print("****************************************")
     print(" P R O M O T I O N S  S E R V I C E   R U N N I N G")
     print("****************************************")
-    service.initialize_logging()
-    service.init_db()
+    with app.app_context():
+        service.init_db()
     app.run(host=HOST, port=int(PORT), debug=DEBUG)
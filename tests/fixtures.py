@@ -0,0 +1,87 @@
+"""
+Database fixtures of the test suites
+
+prepare_database() creates the tables once per test class. RollbackFixture
+then runs every test in a transaction that is rolled back at the end, so
+each test starts from the same empty tables without any DDL. The code under
+test can commit and roll back as it likes: its session transactions are
+SAVEPOINTs inside the transaction of the test.
+
+Statements that commit on their own, like DDL and TRUNCATE on MySQL, end
+the transaction of the test, and the FULLTEXT indexes of InnoDB only find
+committed rows. Tests that need them keep dropping and creating the tables
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from flask_sqlalchemy import SignallingSession
+from app import db
+
+
+def prepare_database(app):
+    """ Creates the tables of app, call it before the app connects """
+    engine = db.get_engine(app)
+    if engine.dialect.name == 'sqlite':
+        # pysqlite begins and commits transactions behind the back of
+        # SQLAlchemy, which breaks SAVEPOINTs, so SQLAlchemy emits BEGIN
+        @event.listens_for(engine, 'connect')
+        def disable_pysqlite_transactions(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(engine, 'begin')
+        def begin(connection):
+            connection.execute('BEGIN')
+
+        if isinstance(engine.pool, StaticPool):
+            # every checkout of an in-memory database shares its connection,
+            # returning one must not roll back the transaction of the test
+            engine.pool._reset_on_return = None
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+
+class SavepointSession(SignallingSession):
+    """ A session whose transactions are SAVEPOINTs """
+
+    def __init__(self, *args, **kwargs):
+        SignallingSession.__init__(self, *args, **kwargs)
+        self.begin_savepoint()
+
+    def begin_savepoint(self):
+        """ Emits the SAVEPOINT now, so requests only count their own queries """
+        self.begin_nested()
+        self.connection()
+
+
+@event.listens_for(SavepointSession, 'after_transaction_end')
+def restart_savepoint(session, transaction):
+    """ Starts the next SAVEPOINT when the code under test ends one """
+    if transaction.nested and not transaction._parent.nested:
+        session.expire_all()
+        session.begin_savepoint()
+
+
+class RollbackFixture(object):
+    """ Runs a test in a transaction that is rolled back afterwards """
+
+    def __init__(self):
+        self.connection = None
+        self.transaction = None
+        self.session = None
+
+    def start(self):
+        """ Begins the transaction, call it in setUp in an app context """
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self.session = db.session
+        db.session = scoped_session(sessionmaker(class_=SavepointSession, db=db,
+                                                 bind=self.connection, binds={},
+                                                 query_cls=db.Query))
+
+    def stop(self):
+        """ Rolls back everything the test wrote """
+        db.session.remove()
+        db.session = self.session
+        self.transaction.rollback()
+        self.connection.close()
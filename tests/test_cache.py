@@ -0,0 +1,162 @@
+"""
+Cache Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+coverage report -m
+"""
+
+import os
+import time
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from app.cache import LRUCache, SharedCache, create_cache
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestLRUCache(unittest.TestCase):
+    """ Test Cases for the LRU Cache """
+
+    def test_get_and_set(self):
+        """ Cache a value and read it back """
+        cache = LRUCache(maxsize=2, ttl=60)
+        self.assertEqual(cache.get(1), None)
+        cache.set(1, {'id': 1})
+        self.assertEqual(cache.get(1), {'id': 1})
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['size'], 1)
+
+    def test_evicts_least_recently_used(self):
+        """ Evict the least recently used entry when full """
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set(1, 'one')
+        cache.set(2, 'two')
+        cache.get(1)
+        cache.set(3, 'three')
+        self.assertEqual(cache.get(2), None)
+        self.assertEqual(cache.get(1), 'one')
+        self.assertEqual(cache.get(3), 'three')
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_expires_entries(self):
+        """ Treat entries older than the ttl as misses """
+        cache = LRUCache(maxsize=2, ttl=0.01)
+        cache.set(1, 'one')
+        time.sleep(0.02)
+        self.assertEqual(cache.get(1), None)
+
+    def test_delete_and_clear(self):
+        """ Invalidate one entry and then all of them """
+        cache = LRUCache(maxsize=10, ttl=60)
+        cache.set(1, 'one')
+        cache.set(2, 'two')
+        cache.delete(1)
+        self.assertEqual(cache.get(1), None)
+        self.assertEqual(cache.get(2), 'two')
+        cache.clear()
+        self.assertEqual(cache.get(2), None)
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_disabled(self):
+        """ A cache with a maxsize of 0 stores nothing """
+        cache = LRUCache(maxsize=0, ttl=60)
+        cache.set(1, 'one')
+        self.assertEqual(cache.get(1), None)
+
+    def test_stale_version_is_not_cached(self):
+        """ Do not cache a value read before an invalidation """
+        cache = LRUCache(maxsize=10, ttl=60)
+        version = cache.version(1)
+        cache.delete(1)
+        cache.set(1, 'stale', version)
+        self.assertEqual(cache.get(1), None)
+        version = cache.version(1)
+        cache.clear()
+        cache.set(1, 'stale', version)
+        self.assertEqual(cache.get(1), None)
+        cache.set(1, 'fresh', cache.version(1))
+        self.assertEqual(cache.get(1), 'fresh')
+
+
+class TestSharedCache(unittest.TestCase):
+    """ Test Cases for the Shared Cache """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_between_instances(self):
+        """ Read a value cached by another worker """
+        worker1 = SharedCache(self.path, maxsize=10, ttl=60)
+        worker2 = SharedCache(self.path, maxsize=10, ttl=60)
+        worker1.set(1, {'id': 1, 'promo_name': 'random'})
+        self.assertEqual(worker2.get(1), {'id': 1, 'promo_name': 'random'})
+        self.assertEqual(worker2.stats()['hits'], 1)
+        self.assertEqual(worker2.stats()['size'], 1)
+
+    def test_invalidation_seen_by_other_instances(self):
+        """ Invalidate in one worker and miss in the other """
+        worker1 = SharedCache(self.path, maxsize=10, ttl=60)
+        worker2 = SharedCache(self.path, maxsize=10, ttl=60)
+        version = worker1.version(1)
+        worker2.delete(1)
+        worker1.set(1, 'stale', version)
+        self.assertEqual(worker2.get(1), None)
+        worker1.set(1, 'one', worker1.version(1))
+        worker1.set(2, 'two', worker1.version(2))
+        worker2.clear()
+        self.assertEqual(worker1.get(1), None)
+        self.assertEqual(worker1.get(2), None)
+
+    def test_locked_file(self):
+        """ Log and count the invalidations of a locked file instead of failing """
+        cache = SharedCache(self.path, maxsize=10, ttl=60)
+        cache.set(1, 'one')
+        cache._connection().execute('PRAGMA busy_timeout = 0')
+        other = sqlite3.connect(self.path, isolation_level=None)
+        other.execute('BEGIN IMMEDIATE')
+        try:
+            cache.delete(1)
+            cache.clear()
+        finally:
+            other.execute('ROLLBACK')
+            other.close()
+        self.assertEqual(cache.stats()['failed_invalidations'], 2)
+        cache.delete(1)
+        self.assertEqual(cache.get(1), None)
+
+    def test_expires_and_evicts(self):
+        """ Expire old entries and evict above maxsize """
+        cache = SharedCache(self.path, maxsize=2, ttl=60)
+        cache.PRUNE_INTERVAL = 1
+        for key in range(4):
+            cache.set(key, key)
+        self.assertEqual(cache.stats()['size'], 2)
+        self.assertEqual(cache.stats()['evictions'], 2)
+        cache.ttl = -1
+        cache.set(9, 9)
+        self.assertEqual(cache.get(9), None)
+
+    def test_create_cache(self):
+        """ Select the backend from the configuration """
+        config = {'PROMOTION_CACHE_SIZE': 10, 'PROMOTION_CACHE_TTL': 60}
+        self.assertTrue(isinstance(create_cache(config), LRUCache))
+        config.update(CACHE_BACKEND='shared', CACHE_PATH=self.path)
+        self.assertTrue(isinstance(create_cache(config), SharedCache))
+        config.update(CACHE_BACKEND='bogus')
+        self.assertRaises(ValueError, create_cache, config)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
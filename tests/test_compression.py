@@ -0,0 +1,110 @@
+"""
+Compression Middleware Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+coverage report -m
+"""
+
+import zlib
+import types
+import unittest
+from app.compression import CompressionMiddleware, negotiate, parse_accept_encoding
+
+BODY = '[' + ','.join(['{"category": "Fruit", "goods_name": "Apple"}'] * 100) + ']'
+
+def make_app(body=BODY, status='200 OK', headers=None, streamed=False):
+    """ Returns a WSGI app that answers with body """
+    def app(environ, start_response):
+        response_headers = [('Content-Type', 'application/json')] + (headers or [])
+        if not streamed:
+            response_headers.append(('Content-Length', str(len(body))))
+        start_response(status, response_headers)
+        if streamed:
+            return (body[start:start + 100] for start in range(0, len(body), 100))
+        return [body]
+    return app
+
+def call(app, accept_encoding='gzip', method='GET'):
+    """ Calls app and returns the status, the headers and the body iterable """
+    response = {}
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = dict(headers)
+    body = app({'REQUEST_METHOD': method, 'HTTP_ACCEPT_ENCODING': accept_encoding}, start_response)
+    return response['status'], response['headers'], body
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestCompressionMiddleware(unittest.TestCase):
+    """ Test Cases for the Compression Middleware """
+
+    def test_negotiate(self):
+        """ Pick the preferred encoding the client accepts """
+        self.assertEqual(parse_accept_encoding('gzip;q=0.5, deflate'), {'gzip': 0.5, 'deflate': 1.0})
+        self.assertEqual(negotiate('gzip, deflate'), negotiate('deflate, gzip'))
+        self.assertEqual(negotiate('gzip;q=0.5, deflate'), 'deflate')
+        self.assertEqual(negotiate('gzip;q=0, identity'), None)
+        self.assertEqual(negotiate('*', ('gzip', 'deflate')), 'gzip')
+        self.assertEqual(negotiate(''), None)
+
+    def test_gzip(self):
+        """ Gzip a large response and set its length """
+        status, headers, body = call(CompressionMiddleware(make_app()))
+        data = ''.join(body)
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(int(headers['Content-Length']), len(data))
+        self.assertLess(len(data) * 10, len(BODY))
+        self.assertEqual(zlib.decompress(data, 16 + zlib.MAX_WBITS), BODY)
+
+    def test_deflate(self):
+        """ Deflate a large response """
+        status, headers, body = call(CompressionMiddleware(make_app()), 'deflate')
+        self.assertEqual(headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(''.join(body)), BODY)
+
+    def test_small_response(self):
+        """ Send a response below the minimum size as it is """
+        status, headers, body = call(CompressionMiddleware(make_app(), min_size=len(BODY) + 1))
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(''.join(body), BODY)
+
+    def test_not_accepted(self):
+        """ Send the response as it is when the client accepts no encoding """
+        status, headers, body = call(CompressionMiddleware(make_app()), 'identity')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(''.join(body), BODY)
+
+    def test_streamed_response(self):
+        """ Compress a streamed response chunk by chunk """
+        status, headers, body = call(CompressionMiddleware(make_app(streamed=True)))
+        self.assertIsInstance(body, types.GeneratorType)
+        self.assertNotIn('Content-Length', headers)
+        self.assertEqual(zlib.decompress(''.join(body), 16 + zlib.MAX_WBITS), BODY)
+
+    def test_streamed_response_is_flushed(self):
+        """ Send the compressed chunks of a streamed response before its end """
+        middleware = CompressionMiddleware(make_app(streamed=True), flush_size=200)
+        status, headers, body = call(middleware)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # the app yields 100 bytes at a time, the first chunk only starts the gzip stream
+        self.assertEqual(decompressor.decompress(next(body) + next(body)), BODY[:200])
+        self.assertEqual(decompressor.decompress(next(body)), BODY[200:400])
+
+    def test_skipped_responses(self):
+        """ Leave encoded, not modified and HEAD responses alone """
+        app = make_app(headers=[('Content-Encoding', 'gzip')])
+        self.assertEqual(call(CompressionMiddleware(app))[1]['Content-Encoding'], 'gzip')
+        status, headers, body = call(CompressionMiddleware(make_app(status='304 Not Modified')))
+        self.assertNotIn('Content-Encoding', headers)
+        status, headers, body = call(CompressionMiddleware(make_app()), method='HEAD')
+        self.assertNotIn('Content-Encoding', headers)
+
+    def test_weak_etag(self):
+        """ Make the ETag of a compressed response weak """
+        app = make_app(headers=[('ETag', '"abc"')])
+        self.assertEqual(call(CompressionMiddleware(app))[1]['ETag'], 'W/"abc"')
+        self.assertEqual(call(CompressionMiddleware(app), 'identity')[1]['ETag'], '"abc"')
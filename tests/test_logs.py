@@ -0,0 +1,83 @@
+"""
+Logging Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+coverage report -m
+"""
+
+import json
+import logging
+import threading
+import unittest
+from app.logs import JsonFormatter, TextFormatter, PayloadSampler, BoundedQueueHandler
+
+class ListHandler(logging.Handler):
+    """ Keeps the formatted records, optionally waiting for an event first """
+
+    def __init__(self, event=None):
+        logging.Handler.__init__(self)
+        self.lines = []
+        self.event = event
+
+    def emit(self, record):
+        if self.event:
+            self.event.wait()
+        self.lines.append(self.format(record))
+
+def make_record(message, args=(), **extra):
+    """ Returns a LogRecord with extra attributes """
+    record = logging.LogRecord('app.test', logging.INFO, __file__, 1, message, args, None)
+    record.__dict__.update(extra)
+    return record
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestLogging(unittest.TestCase):
+    """ Test Cases for the Logging pipeline """
+
+    def test_json_formatter(self):
+        """ Format a record and its extra fields as JSON """
+        line = JsonFormatter().format(make_record('Saved %s', ('promotion',), payload={'price': 2.99}))
+        entry = json.loads(line)
+        self.assertEqual(entry['message'], 'Saved promotion')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['logger'], 'app.test')
+        self.assertEqual(entry['payload'], {'price': 2.99})
+        self.assertNotIn('args', entry)
+
+    def test_text_formatter(self):
+        """ Append the payload to the text format """
+        line = TextFormatter('%(message)s').format(make_record('Create payload', payload={'id': 1}))
+        self.assertEqual(line, 'Create payload payload={"id": 1}')
+
+    def test_payload_sampler(self):
+        """ Drop the payload records that are not sampled """
+        sampler = PayloadSampler(0)
+        self.assertTrue(sampler.filter(make_record('no payload')))
+        self.assertFalse(sampler.filter(make_record('Create payload', payload={})))
+        self.assertEqual(sampler.sampled_out, 1)
+        self.assertTrue(PayloadSampler(1).filter(make_record('Create payload', payload={})))
+
+    def test_queue_handler(self):
+        """ Write the records from the listener thread """
+        sink = ListHandler()
+        sink.setFormatter(logging.Formatter('%(message)s'))
+        handler = BoundedQueueHandler(sink)
+        handler.handle(make_record('Promotion %d saved', (7,)))
+        handler.close()
+        self.assertEqual(sink.lines, ['Promotion 7 saved'])
+        self.assertEqual(handler.dropped, 0)
+
+    def test_queue_overflow(self):
+        """ Drop and count the records that do not fit in the queue """
+        unblock = threading.Event()
+        sink = ListHandler(unblock)
+        handler = BoundedQueueHandler(sink, maxsize=2)
+        for number in range(10):
+            handler.handle(make_record('record {}'.format(number)))
+        self.assertGreaterEqual(handler.dropped, 7)
+        unblock.set()
+        handler.close()
+        self.assertEqual(len(sink.lines) + handler.dropped, 10)
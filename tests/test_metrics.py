@@ -0,0 +1,90 @@
+"""
+Metrics Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+coverage report -m
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from app.metrics import MetricsRegistry, LATENCY_BUCKETS
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestMetricsRegistry(unittest.TestCase):
+    """ Test Cases for the Metrics Registry """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_render_counter(self):
+        """ Render a counter with its labels """
+        registry = MetricsRegistry()
+        registry.inc('requests_total', {'endpoint': 'PromotionResource', 'status': 200})
+        registry.inc('requests_total', {'endpoint': 'PromotionResource', 'status': 200})
+        text = registry.render()
+        self.assertIn('# TYPE requests_total counter', text)
+        self.assertIn('requests_total{endpoint="PromotionResource",status="200"} 2', text)
+
+    def test_render_histogram(self):
+        """ Render a histogram with cumulative buckets """
+        registry = MetricsRegistry()
+        registry.observe('latency_seconds', {'endpoint': 'PromotionCollection'}, 0.003, LATENCY_BUCKETS)
+        registry.observe('latency_seconds', {'endpoint': 'PromotionCollection'}, 0.2, LATENCY_BUCKETS)
+        registry.observe('latency_seconds', {'endpoint': 'PromotionCollection'}, 60, LATENCY_BUCKETS)
+        text = registry.render()
+        self.assertIn('# TYPE latency_seconds histogram', text)
+        self.assertIn('latency_seconds_bucket{endpoint="PromotionCollection",le="0.005"} 1', text)
+        self.assertIn('latency_seconds_bucket{endpoint="PromotionCollection",le="0.25"} 2', text)
+        self.assertIn('latency_seconds_bucket{endpoint="PromotionCollection",le="10.0"} 2', text)
+        self.assertIn('latency_seconds_bucket{endpoint="PromotionCollection",le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count{endpoint="PromotionCollection"} 3', text)
+
+    def test_workers_are_added_up(self):
+        """ Add up the metrics flushed by several workers """
+        first = MetricsRegistry(self.directory)
+        first.inc('requests_total', {'endpoint': 'PromotionResource'}, 3)
+        first.observe('latency_seconds', {'endpoint': 'PromotionResource'}, 0.1, LATENCY_BUCKETS)
+        first.flush(force=True)
+        # stands in for the file of another worker process
+        os.rename(os.path.join(self.directory, 'metrics-{}.json'.format(os.getpid())),
+                  os.path.join(self.directory, 'metrics-1.json'))
+        second = MetricsRegistry(self.directory)
+        second.inc('requests_total', {'endpoint': 'PromotionResource'}, 2)
+        second.observe('latency_seconds', {'endpoint': 'PromotionResource'}, 0.1, LATENCY_BUCKETS)
+        text = second.render()
+        self.assertIn('requests_total{endpoint="PromotionResource"} 5', text)
+        self.assertIn('latency_seconds_count{endpoint="PromotionResource"} 2', text)
+
+    def test_flush_interval(self):
+        """ Write the file of the worker at most once per interval """
+        registry = MetricsRegistry(self.directory, flush_interval=3600)
+        registry.flush()
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        os.remove(os.path.join(self.directory, os.listdir(self.directory)[0]))
+        registry.flush()
+        self.assertEqual(os.listdir(self.directory), [])
+        registry.flush(force=True)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+
+class TestQueryHooks(unittest.TestCase):
+    """ Test Cases for the timing of the statements """
+
+    def test_failed_statement(self):
+        """ Leave nothing on the connection when a statement fails """
+        engine = create_engine('sqlite://')
+        connection = engine.connect()
+        self.assertRaises(OperationalError, connection.execute, 'SELECT * FROM nowhere')
+        self.assertEqual(connection.execute('SELECT 1').scalar(), 1)
+        self.assertEqual(dict(connection.info), {})
+        connection.close()
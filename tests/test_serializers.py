@@ -0,0 +1,43 @@
+"""
+Serializers Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+coverage report -m
+"""
+
+import json
+import unittest
+from datetime import datetime
+from app.serializers import RowSerializer, dumps
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestRowSerializer(unittest.TestCase):
+    """ Test Cases for the Row Serializer """
+
+    def test_serialize_rows(self):
+        """ Serialize rows into dictionaries without their extra columns """
+        serializer = RowSerializer(('id', 'discount'), '%Y-%m-%d')
+        rows = [(1, 0.5, 7), (2, 0.25, 3)]
+        self.assertEqual(serializer(rows), [{'id': 1, 'discount': 0.5}, {'id': 2, 'discount': 0.25}])
+
+    def test_serialize_timestamps(self):
+        """ Format the timestamps of the rows """
+        serializer = RowSerializer(('id', 'updated_at'), '%Y-%m-%d')
+        rows = [(1, datetime(2018, 10, 1)), (2, None)]
+        self.assertEqual(serializer(rows), [{'id': 1, 'updated_at': '2018-10-01'},
+                                            {'id': 2, 'updated_at': None}])
+
+    def test_dumps(self):
+        """ Encode rows as JSON without losing precision """
+        data = [{'id': 1, 'price': 1000.123456789, 'available': True, 'category': None}]
+        self.assertEqual(json.loads(dumps(data)), data)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -30,7 +30,11 @@ def get_database_uri():
       1) In Bluemix with MySQL bound through VCAP_SERVICES
       2) With MySQL running on the local server as with Travis CI
       3) With MySQL --link in a Docker container called 'mariadb'
+    DATABASE_URI in the environment overrides all of them
     """
+    if 'DATABASE_URI' in os.environ:
+        logging.info("Using DATABASE_URI...")
+        return os.environ['DATABASE_URI']
     # Get the credentials from the Bluemix environment
     if 'VCAP_SERVICES' in os.environ:
         logging.info("Using VCAP_SERVICES...")